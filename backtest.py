@@ -0,0 +1,361 @@
+"""בקטסט וקטורי לכללי האיתות של הבוט (כניסה / סטופלוס / יעדים) על קבצי נתונים מקומיים.
+
+מניות וקריפטו נבדקים בנפרד, כל סוג עם הכלל שהבוט מפרסם עבורו, והתוצאות מדווחות לפי סוג נכס.
+
+קובץ CSV לכל סימבול בתיקיית הנתונים, למשל data/AAPL.csv או data/BTC_USD.csv,
+עם העמודות datetime,open,high,low,close,volume (ברי יומיים).
+
+    python backtest.py --data-dir data
+    python backtest.py --data-dir data --sweep --workers 8 --top 20
+"""
+import argparse
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from bot_only import CRYPTO_SIGNAL_RULE, PREMIUM_CRYPTO, PREMIUM_STOCKS, STOCK_SIGNAL_RULE
+
+logger = logging.getLogger(__name__)
+
+# פרמטרים ברירת מחדל - הכלל שהבוט מפרסם בפועל
+DEFAULT_PARAMS = {
+    **STOCK_SIGNAL_RULE,
+    'entry_window': 5,  # מספר ברים שבהם פקודת הכניסה בתוקף
+    'horizon': 20,  # מספר ברים מקסימלי להחזקת עסקה
+    'exit_target': 1,  # היעד שסוגר את העסקה (1 או 2)
+}
+
+CRYPTO_DEFAULT_PARAMS = {**DEFAULT_PARAMS, **CRYPTO_SIGNAL_RULE}
+
+# רשת פרמטרים לסריקה
+SWEEP_GRID = {
+    'entry': [1.0, 1.01, 1.02, 1.03],
+    'stop': [0.93, 0.95, 0.97],
+    'target1': [1.04, 1.06, 1.08, 1.10],
+    'target2': [1.15],
+    'entry_window': [3, 5],
+    'horizon': [10, 20, 40],
+    'exit_target': [1, 2],
+}
+
+# קריפטו תנודתי יותר - סטופים ויעדים רחבים יותר
+CRYPTO_SWEEP_GRID = {
+    **SWEEP_GRID,
+    'entry': [1.0, 1.02, 1.03, 1.05],
+    'stop': [0.88, 0.92, 0.95],
+    'target1': [1.08, 1.12, 1.16],
+    'target2': [1.25],
+}
+
+# סוג נכס -> (סימבולים, כלל ברירת המחדל, רשת הסריקה)
+ASSET_CLASSES = {
+    'stock': ([s['symbol'] for s in PREMIUM_STOCKS], DEFAULT_PARAMS, SWEEP_GRID),
+    'crypto': ([c['symbol'] for c in PREMIUM_CRYPTO], CRYPTO_DEFAULT_PARAMS, CRYPTO_SWEEP_GRID),
+}
+
+OUTCOME_NO_FILL, OUTCOME_STOP, OUTCOME_TARGET, OUTCOME_TIMEOUT = 0, 1, 2, 3
+
+
+def symbol_file_name(symbol):
+    """שם קובץ הנתונים של סימבול (BTC/USD -> BTC_USD.csv)"""
+    return symbol.replace('/', '_') + '.csv'
+
+
+def load_bars(data_dir, symbols):
+    """טעינת ברים לכל הסימבולים שיש להם קובץ - {symbol: DataFrame}"""
+    bars = {}
+    for symbol in symbols:
+        path = os.path.join(data_dir, symbol_file_name(symbol))
+        if not os.path.exists(path):
+            continue
+        df = pd.read_csv(path, parse_dates=['datetime']).sort_values('datetime')
+        df = df.dropna(subset=['open', 'high', 'low', 'close'])
+        if len(df) > 1:
+            bars[symbol] = df
+    return bars
+
+
+def pack_bars(bars, pad):
+    """איחוד כל הסימבולים למערך אחד, עם ריפוד NaN בין סימבולים כדי שחלונות לא יחצו ביניהם"""
+    columns = {name: [] for name in ('open', 'high', 'low', 'close')}
+    dates, valid = [], []
+    for df in bars.values():
+        for name in columns:
+            columns[name].append(df[name].to_numpy(dtype=np.float64))
+            columns[name].append(np.full(pad, np.nan))
+        dates.append(df['datetime'].to_numpy(dtype='datetime64[s]'))
+        dates.append(np.full(pad, np.datetime64('NaT'), dtype='datetime64[s]'))
+        valid.append(np.ones(len(df), dtype=bool))
+        valid.append(np.zeros(pad, dtype=bool))
+
+    packed = {name: np.concatenate(arrays) for name, arrays in columns.items()}
+    packed['valid'] = np.concatenate(valid)
+    # זמן כמספר (שניות) - NaN בריפוד
+    timestamps = np.concatenate(dates)
+    packed['timestamp'] = np.where(packed['valid'], timestamps.astype(np.int64), np.nan)
+    return packed
+
+
+def _forward_windows(values, horizon):
+    """חלון של horizon הברים שאחרי כל בר (view ללא העתקה)"""
+    shifted = np.concatenate([values[1:], np.full(horizon, np.nan)])
+    return sliding_window_view(shifted, horizon)[:len(values)]
+
+
+def _first_true(mask):
+    """האינדקס הראשון של True בכל שורה, או מספר העמודות אם אין"""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def _first_reach(windows, name, level):
+    """העמודה הראשונה שבה שורה לא-יורדת מגיעה ל-level, או רוחב החלון.
+
+    התוצאה נשמרת לפי (מערך, רמה) - בסריקה יש מעט רמות שונות לכל אופק.
+    """
+    key = (name, level)
+    cache = windows['reach_cache']
+    if key not in cache:
+        cumulative = windows[name]
+        cache[key] = (cumulative < level).view(np.uint8).sum(axis=1, dtype=np.uint8).astype(np.intp)
+    return cache[key]
+
+
+def _first_hit_after(windows, level, fill_idx, filled, above):
+    """הבר הראשון אחרי המילוי שבו המחיר מגיע לרמה"""
+    if above:
+        idx = _first_reach(windows, 'max_high', level)
+    else:
+        idx = _first_reach(windows, 'neg_min_low', -level)
+    # פגיעה לפני המילוי או בבר המילוי - חישוב מחדש רק לשורות האלה
+    redo = np.flatnonzero(filled & (idx <= fill_idx))
+    if len(redo):
+        idx = idx.copy()
+        sub = windows['high' if above else 'low'][redo]
+        mask = (sub >= level) if above else (sub <= level)
+        mask &= np.arange(sub.shape[1])[None, :] > fill_idx[redo, None]
+        idx[redo] = _first_true(mask)
+    return idx
+
+
+def prepare_windows(packed, horizon):
+    """חישובים שתלויים רק באופק - משותפים לכל צירופי הפרמטרים עם אותו אופק.
+
+    המחירים בחלון נשמרים ביחס לסגירה של בר האיתות, כך שכל רמות הכלל הן סקלרים.
+    """
+    max_pad = len(packed['valid']) - np.flatnonzero(packed['valid'])[-1] - 1
+    if horizon > max_pad or horizon > 255:
+        raise ValueError(f"horizon {horizon} exceeds padding {max_pad}")
+
+    close = packed['close'][:, None]
+    windows = {'horizon': horizon}
+    with np.errstate(invalid='ignore'):
+        for name in ('open', 'high', 'low', 'close'):
+            windows[name] = (_forward_windows(packed[name], horizon) / close).astype(np.float32)
+    # מקסימום/מינימום מצטבר לאורך החלון - שורות לא-יורדות, NaN (ריפוד) לעולם לא "מגיע"
+    windows['max_high'] = np.nan_to_num(np.fmax.accumulate(windows['high'], axis=1), nan=-np.inf)
+    windows['neg_min_low'] = np.nan_to_num(-np.fmin.accumulate(windows['low'], axis=1), nan=-np.inf)
+    windows['reach_cache'] = {}
+    windows['last_idx'] = np.maximum((~np.isnan(windows['close'])).sum(axis=1) - 1, 0)
+    windows['timestamp'] = _forward_windows(packed['timestamp'], horizon)
+    return windows
+
+
+def simulate(packed, params, windows=None):
+    """סימולציה וקטורית של איתות על כל בר - מחזיר תוצאה, תשואה, זמן יציאה והאם יעד 2 הושג"""
+    horizon = params['horizon']
+    if windows is None or windows['horizon'] != horizon:
+        windows = prepare_windows(packed, horizon)
+    rows = np.arange(len(packed['valid']))
+
+    entry = params['entry']
+    stop = params['stop']
+    target = params['target1'] if params['exit_target'] == 1 else params['target2']
+    target2 = params['target2']
+
+    # כניסה: פריצה מעל המחיר (או ירידה אליו, אם הכניסה מתחת למחיר הנוכחי)
+    breakout = entry >= 1
+    if breakout:
+        fill_idx = _first_reach(windows, 'max_high', entry)
+    else:
+        fill_idx = _first_reach(windows, 'neg_min_low', -entry)
+    filled = packed['valid'] & (fill_idx < min(params['entry_window'], horizon))
+    # מחיר מילוי: מחיר הכניסה, או פתיחה בגאפ אם הבר נפתח מעבר לו
+    fill_open = windows['open'][rows, np.minimum(fill_idx, horizon - 1)]
+    fill_price = np.fmax(entry, fill_open) if breakout else np.fmin(entry, fill_open)
+
+    # יציאות נבדקות רק מהבר שאחרי המילוי
+    stop_idx = _first_hit_after(windows, stop, fill_idx, filled, above=False)
+    target_idx = _first_hit_after(windows, target, fill_idx, filled, above=True)
+    if target2 == target:
+        target2_idx = target_idx
+    else:
+        target2_idx = _first_hit_after(windows, target2, fill_idx, filled, above=True)
+
+    # בר שנוגע בסטופ וביעד יחד נספר כסטופ (הנחה שמרנית)
+    stopped = filled & (stop_idx < horizon) & (stop_idx <= target_idx)
+    targeted = filled & (target_idx < horizon) & (target_idx < stop_idx)
+    timed_out = filled & ~stopped & ~targeted
+
+    last_idx = windows['last_idx']
+    exit_idx = np.where(stopped, stop_idx, np.where(targeted, target_idx, last_idx)).clip(max=horizon - 1)
+    exit_open = windows['open'][rows, exit_idx]
+    timeout_close = windows['close'][rows, last_idx]
+
+    exit_price = np.where(stopped, np.fmin(stop, exit_open),
+                          np.where(targeted, np.fmax(target, exit_open), timeout_close))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.where(filled, exit_price / fill_price - 1, np.nan)
+
+    outcome = np.full(len(rows), OUTCOME_NO_FILL, dtype=np.int8)
+    outcome[stopped] = OUTCOME_STOP
+    outcome[targeted] = OUTCOME_TARGET
+    outcome[timed_out] = OUTCOME_TIMEOUT
+
+    exit_dates = windows['timestamp'][rows, exit_idx]
+    reached_target2 = filled & (target2_idx < horizon) & (target2_idx < stop_idx)
+    return outcome, returns, exit_dates, reached_target2
+
+
+def summarize(outcome, returns, exit_dates, reached_target2, signals):
+    """שיעורי פגיעה, תוחלת ודרואודאון מתוצאות הסימולציה"""
+    traded = outcome != OUTCOME_NO_FILL
+    trades = int(traded.sum())
+    result = {
+        'signals': int(signals),
+        'trades': trades,
+        'fill_rate': trades / signals if signals else 0.0,
+    }
+    if not trades:
+        return {**result, 'target_rate': 0.0, 'target2_rate': 0.0, 'stop_rate': 0.0, 'timeout_rate': 0.0,
+                'expectancy': 0.0, 'avg_win': 0.0, 'avg_loss': 0.0, 'profit_factor': 0.0, 'max_drawdown': 0.0}
+
+    trade_returns = returns[traded]
+    wins = trade_returns[trade_returns > 0]
+    losses = trade_returns[trade_returns <= 0]
+
+    # עקומת הון: סכום תשואות העסקאות (יחידת השקעה קבועה) לפי סדר היציאה
+    order = np.argsort(exit_dates[traded], kind='stable')
+    equity = np.cumsum(trade_returns[order])
+    drawdown = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity
+
+    return {
+        **result,
+        'target_rate': float((outcome == OUTCOME_TARGET).sum() / trades),
+        'target2_rate': float(reached_target2[traded].sum() / trades),
+        'stop_rate': float((outcome == OUTCOME_STOP).sum() / trades),
+        'timeout_rate': float((outcome == OUTCOME_TIMEOUT).sum() / trades),
+        'expectancy': float(trade_returns.mean()),
+        'avg_win': float(wins.mean()) if len(wins) else 0.0,
+        'avg_loss': float(losses.mean()) if len(losses) else 0.0,
+        'profit_factor': float(wins.sum() / -losses.sum()) if losses.sum() < 0 else float('inf'),
+        'max_drawdown': float(drawdown.max()),
+    }
+
+
+def run_params(packed, params, windows=None):
+    outcome, returns, exit_dates, reached_target2 = simulate(packed, params, windows)
+    return {**params, **summarize(outcome, returns, exit_dates, reached_target2, packed['valid'].sum())}
+
+
+_worker_packed = None
+_worker_windows = None
+
+
+def _init_worker(packed):
+    global _worker_packed
+    _worker_packed = packed
+
+
+def _run_worker(params):
+    # החלונות של האופק האחרון נשמרים בתהליך - הסריקה ממוינת לפי אופק
+    global _worker_windows
+    if _worker_windows is None or _worker_windows['horizon'] != params['horizon']:
+        _worker_windows = None
+        _worker_windows = prepare_windows(_worker_packed, params['horizon'])
+    return run_params(_worker_packed, params, _worker_windows)
+
+
+def sweep_params(grid):
+    """כל צירופי הפרמטרים ברשת, ממוינים לפי אופק - רק צירופים הגיוניים (סטופ < כניסה < יעדים)"""
+    keys = list(grid)
+    seen = set()
+    for values in itertools.product(*(grid[key] for key in keys)):
+        params = dict(zip(keys, values))
+        if not params['stop'] < params['entry'] < params['target1'] <= params['target2']:
+            continue
+        # כשיעד 2 סוגר את העסקה, יעד 1 לא משפיע על התוצאה
+        effective = tuple(v for k, v in params.items() if not (k == 'target1' and params['exit_target'] == 2))
+        if effective in seen:
+            continue
+        seen.add(effective)
+        yield params
+
+
+def run_sweep(packed, param_sets, workers=None):
+    """הרצת סריקת פרמטרים במקביל על פני תהליכים"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(packed,)) as executor:
+        return list(executor.map(_run_worker, param_sets, chunksize=8))
+
+
+def format_results(results, top):
+    df = pd.DataFrame(results).sort_values('expectancy', ascending=False).head(top)
+    percent_columns = ['fill_rate', 'target_rate', 'target2_rate', 'stop_rate', 'timeout_rate',
+                       'expectancy', 'avg_win', 'avg_loss', 'max_drawdown']
+    for column in percent_columns:
+        df[column] = (df[column] * 100).round(2)
+    df['profit_factor'] = df['profit_factor'].round(2)
+    return df.to_string(index=False)
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Vectorized backtest of the PeakTrade signal rule")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--sweep', action='store_true', help="run the full parameter grid")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help="write all results to this CSV file")
+    args = parser.parse_args()
+
+    all_results = []
+    for asset_type, (symbols, default_params, grid) in ASSET_CLASSES.items():
+        started = time.perf_counter()
+        bars = load_bars(args.data_dir, symbols)
+        if not bars:
+            logger.warning(f"⚠️ No {asset_type} data files found in {args.data_dir}")
+            continue
+        param_sets = sorted(sweep_params(grid), key=lambda p: p['horizon']) if args.sweep else [default_params]
+        packed = pack_bars(bars, max(p['horizon'] for p in param_sets))
+        logger.info(f"📊 Loaded {len(bars)} {asset_type} symbols, {int(packed['valid'].sum())} bars in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        if len(param_sets) > 1:
+            results = run_sweep(packed, param_sets, args.workers)
+        else:
+            results = [run_params(packed, param_sets[0])]
+        logger.info(f"✅ {len(param_sets)} {asset_type} parameter sets simulated in {time.perf_counter() - started:.2f}s")
+
+        results = [{'asset_type': asset_type, **result} for result in results]
+        print(f"\n{asset_type}:")
+        print(format_results(results, args.top))
+        all_results.extend(results)
+
+    if not all_results:
+        logger.error(f"❌ No data files found in {args.data_dir}")
+        return
+    if args.output:
+        pd.DataFrame(all_results).to_csv(args.output, index=False)
+        logger.info(f"📝 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
 import logging
+import logging.handlers
+import queue
 import os
 import asyncio
 import json
-from datetime import datetime, timedelta
+import collections
+import hashlib
+import sqlite3
+import tempfile
+import time
+import threading
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from telegram.error import TelegramError
@@ -15,12 +27,10 @@ import io
 import random
 import requests
 import pandas as pd
+import numpy as np
+import websockets
 
-# הגדרת לוגינג
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# הגדרת לוגינג - setup_logging() מופעל בהרצת הבוט, כלים שמייבאים את המודול מגדירים לוגים בעצמם
 logger = logging.getLogger(__name__)
 
 # הגדרות המערכת
@@ -30,76 +40,934 @@ GOOGLE_CREDENTIALS = os.getenv('GOOGLE_CREDENTIALS')
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 TWELVE_DATA_API_KEY = os.getenv('TWELVE_DATA_API_KEY')
 
-# בדיקת משתני סביבה
-if not BOT_TOKEN:
-    logger.error("❌ TELEGRAM_BOT_TOKEN environment variable not set!")
-    exit(1)
-if not CHANNEL_ID:
-    logger.error("❌ CHANNEL_ID environment variable not set!")
-    exit(1)
-if not GOOGLE_CREDENTIALS:
-    logger.error("❌ GOOGLE_CREDENTIALS environment variable not set!")
-    exit(1)
-if not SPREADSHEET_ID:
-    logger.error("❌ SPREADSHEET_ID environment variable not set!")
-    exit(1)
-if not TWELVE_DATA_API_KEY:
-    logger.error("❌ TWELVE_DATA_API_KEY environment variable not set!")
-    exit(1)
-
-logger.info("✅ All environment variables are set")
-
 # הגדרות תשלום
 PAYPAL_PAYMENT_LINK = "https://www.paypal.com/ncp/payment/LYPU8NUFJB7XW"
 MONTHLY_PRICE = 120
 
+# מגוון עצום של מניות מכל הסקטורים
+PREMIUM_STOCKS = [
+    # טכנולוגיה גדולה
+    {'symbol': 'AAPL', 'type': 'AAPL', 'sector': 'טכנולוגיה'},
+    {'symbol': 'MSFT', 'type': 'MSFT', 'sector': 'טכנולוגיה'},
+    {'symbol': 'GOOGL', 'type': 'GOOGL', 'sector': 'טכנולוגיה'},
+    {'symbol': 'AMZN', 'type': 'AMZN', 'sector': 'מסחר אלקטרוני'},
+    {'symbol': 'META', 'type': 'META', 'sector': 'רשתות חברתיות'},
+    
+    # AI ושבבים
+    {'symbol': 'NVDA', 'type': 'NVDA', 'sector': 'AI/שבבים'},
+    {'symbol': 'AMD', 'type': 'AMD', 'sector': 'שבבים'},
+    {'symbol': 'INTC', 'type': 'INTC', 'sector': 'שבבים'},
+    {'symbol': 'TSM', 'type': 'TSM', 'sector': 'שבבים'},
+    {'symbol': 'AVGO', 'type': 'AVGO', 'sector': 'שבבים'},
+    
+    # רכב חשמלי ואנרגיה
+    {'symbol': 'TSLA', 'type': 'TSLA', 'sector': 'רכב חשמלי'},
+    {'symbol': 'RIVN', 'type': 'RIVN', 'sector': 'רכב חשמלי'},
+    {'symbol': 'LCID', 'type': 'LCID', 'sector': 'רכב חשמלי'},
+    {'symbol': 'F', 'type': 'F', 'sector': 'רכב'},
+    {'symbol': 'GM', 'type': 'GM', 'sector': 'רכב'},
+    
+    # בנקים ופיננסים
+    {'symbol': 'JPM', 'type': 'JPM', 'sector': 'בנקאות'},
+    {'symbol': 'BAC', 'type': 'BAC', 'sector': 'בנקאות'},
+    {'symbol': 'WFC', 'type': 'WFC', 'sector': 'בנקאות'},
+    {'symbol': 'GS', 'type': 'GS', 'sector': 'השקעות'},
+    {'symbol': 'MS', 'type': 'MS', 'sector': 'השקעות'},
+    
+    # בריאות ותרופות
+    {'symbol': 'JNJ', 'type': 'JNJ', 'sector': 'תרופות'},
+    {'symbol': 'PFE', 'type': 'PFE', 'sector': 'תרופות'},
+    {'symbol': 'MRNA', 'type': 'MRNA', 'sector': 'ביוטכנולוגיה'},
+    {'symbol': 'ABBV', 'type': 'ABBV', 'sector': 'תרופות'},
+    {'symbol': 'UNH', 'type': 'UNH', 'sector': 'ביטוח בריאות'},
+    
+    # תקשורת ומדיה
+    {'symbol': 'NFLX', 'type': 'NFLX', 'sector': 'סטרימינג'},
+    {'symbol': 'DIS', 'type': 'DIS', 'sector': 'בידור'},
+    {'symbol': 'CMCSA', 'type': 'CMCSA', 'sector': 'תקשורת'},
+    {'symbol': 'T', 'type': 'T', 'sector': 'טלקום'},
+    {'symbol': 'VZ', 'type': 'VZ', 'sector': 'טלקום'},
+    
+    # קמעונאות וצריכה
+    {'symbol': 'WMT', 'type': 'WMT', 'sector': 'קמעונאות'},
+    {'symbol': 'TGT', 'type': 'TGT', 'sector': 'קמעונאות'},
+    {'symbol': 'HD', 'type': 'HD', 'sector': 'שיפוצים'},
+    {'symbol': 'LOW', 'type': 'LOW', 'sector': 'שיפוצים'},
+    {'symbol': 'COST', 'type': 'COST', 'sector': 'קמעונאות'},
+    
+    # אנרגיה ונפט
+    {'symbol': 'XOM', 'type': 'XOM', 'sector': 'נפט'},
+    {'symbol': 'CVX', 'type': 'CVX', 'sector': 'נפט'},
+    {'symbol': 'COP', 'type': 'COP', 'sector': 'נפט'},
+    {'symbol': 'SLB', 'type': 'SLB', 'sector': 'שירותי נפט'},
+    
+    # תעופה ותיירות
+    {'symbol': 'BA', 'type': 'BA', 'sector': 'תעופה'},
+    {'symbol': 'AAL', 'type': 'AAL', 'sector': 'חברות תעופה'},
+    {'symbol': 'DAL', 'type': 'DAL', 'sector': 'חברות תעופה'},
+    {'symbol': 'UAL', 'type': 'UAL', 'sector': 'חברות תעופה'},
+    
+    # מזון ומשקאות
+    {'symbol': 'KO', 'type': 'KO', 'sector': 'משקאות'},
+    {'symbol': 'PEP', 'type': 'PEP', 'sector': 'משקאות'},
+    {'symbol': 'MCD', 'type': 'MCD', 'sector': 'מזון מהיר'},
+    {'symbol': 'SBUX', 'type': 'SBUX', 'sector': 'קפה'},
+    
+    # נדל"ן ובנייה
+    {'symbol': 'AMT', 'type': 'AMT', 'sector': 'REIT'},
+    {'symbol': 'PLD', 'type': 'PLD', 'sector': 'נדלן תעשייתי'},
+    {'symbol': 'CCI', 'type': 'CCI', 'sector': 'תשתיות'},
+    
+    # מניות מתפרצות וגדילה
+    {'symbol': 'ROKU', 'type': 'ROKU', 'sector': 'סטרימינג'},
+    {'symbol': 'PLTR', 'type': 'PLTR', 'sector': 'ביג דאטה'},
+    {'symbol': 'SNOW', 'type': 'SNOW', 'sector': 'ענן'},
+    {'symbol': 'CRWD', 'type': 'CRWD', 'sector': 'סייבר'},
+    {'symbol': 'ZM', 'type': 'ZM', 'sector': 'וידאו'},
+    {'symbol': 'SHOP', 'type': 'SHOP', 'sector': 'אי-קומרס'},
+    {'symbol': 'SQ', 'type': 'SQ', 'sector': 'פינטק'},
+    {'symbol': 'PYPL', 'type': 'PYPL', 'sector': 'תשלומים'},
+]
+
+# קריפטו
+PREMIUM_CRYPTO = [
+    {'symbol': 'BTC/USD', 'name': 'Bitcoin', 'type': 'Bitcoin'},
+    {'symbol': 'ETH/USD', 'name': 'Ethereum', 'type': 'Ethereum'},
+    {'symbol': 'BNB/USD', 'name': 'Binance', 'type': 'Binance'},
+    {'symbol': 'XRP/USD', 'name': 'Ripple', 'type': 'Ripple'},
+    {'symbol': 'ADA/USD', 'name': 'Cardano', 'type': 'Cardano'},
+    {'symbol': 'SOL/USD', 'name': 'Solana', 'type': 'Solana'},
+    {'symbol': 'DOGE/USD', 'name': 'Dogecoin', 'type': 'Dogecoin'},
+    {'symbol': 'DOT/USD', 'name': 'Polkadot', 'type': 'Polkadot'},
+    {'symbol': 'AVAX/USD', 'name': 'Avalanche', 'type': 'Avalanche'},
+    {'symbol': 'SHIB/USD', 'name': 'Shiba', 'type': 'Shiba'},
+]
+
+
+# כלל האיתות למניות - יחס למחיר הנוכחי
+STOCK_SIGNAL_RULE = {
+    'entry': 1.02,
+    'stop': 0.95,
+    'target1': 1.08,
+    'target2': 1.15,
+}
+
+# כלל האיתות לקריפטו - יחס למחיר הנוכחי
+CRYPTO_SIGNAL_RULE = {
+    'entry': 1.03,
+    'stop': 0.92,
+    'target1': 1.12,
+    'target2': 1.25,
+}
+
+# הגדרות מעקב תוצאות איתותים
+SIGNALS_DB_FILE = os.getenv('SIGNALS_DB_FILE', 'signals.db')
+SIGNAL_ENTRY_TIMEOUT = timedelta(days=5)  # איתות שלא נכנס תוך 5 ימים נסגר
+SIGNAL_MAX_DURATION = timedelta(days=30)  # עסקה פתוחה נסגרת אחרי 30 יום
+SIGNAL_TRACKING_INTERVAL = '1h'
+SIGNAL_TRACKING_BATCH = 6  # סימבולים לקריאה - מתחת למכסת 8 קרדיטים לדקה, עם מרווח לפרסום תוכן
+CRYPTO_TRACKING_EVERY_HOURS = 3  # ברי השעה שהצטברו נבדקים יחד - 80 קרדיטים ביום לכל היותר
+
+# הגדרות מאגר הברים בזיכרון
+BAR_STORE_CAPACITY = 256  # ברים לכל סימבול - זיכרון קבוע של ~24KB לסימבול
+BAR_CACHE_TTL = timedelta(hours=1)  # ברים יומיים עדכניים לא נמשכים שוב מה-API
+CHART_BARS = 30
+
+# טווחי זמן - נמשך רק הטווח העדין ביותר, השאר מחושבים ממנו מקומית
+TIMEFRAME_SECONDS = {
+    '1min': 60,
+    '5min': 300,
+    '15min': 900,
+    '30min': 1800,
+    '1h': 3600,
+    '4h': 4 * 3600,
+    '1day': 86400,
+    '1week': 7 * 86400,
+}
+STOCK_SESSION = (9 * 3600 + 30 * 60, 16 * 3600)  # 09:30-16:00 בשעון הבורסה (ניו יורק)
+STOCK_EXCHANGE_TZ = ZoneInfo('America/New_York')
+STOCK_CONTENT_TIMEFRAMES = ('1h', '4h', '1day', '1week')
+INTRADAY_BAR_CAPACITY = 2048  # ~300 ימי מסחר של ברי שעה
+
+# הגדרות זרם מחירים חי
+TWELVE_DATA_WS_URL = os.getenv('TWELVE_DATA_WS_URL', 'wss://ws.twelvedata.com/v1/quotes/price')
+TWELVE_DATA_WS_RECORD_FILE = os.getenv('TWELVE_DATA_WS_RECORD_FILE')
+PRICE_STREAM_MAX_AGE = 120  # שניות - טיק ישן יותר (ניתוק, backoff) לא מוצג כמחיר נוכחי
+
+# הגדרות קליטת צילומי מסך של תשלום
+ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')  # צ'אט המנהל לאישור תשלומים (אופציונלי)
+PAYMENT_SCREENSHOTS_DIR = os.getenv('PAYMENT_SCREENSHOTS_DIR', 'payment_screenshots')
+SCREENSHOT_WORKERS = 3
+SCREENSHOT_CHUNK_SIZE = 64 * 1024
+REVIEW_ID_LENGTH = 24  # תחילית ה-hash בכפתורי המנהל - callback_data מוגבל ל-64 בתים
+
+# מספר העדכונים מטלגרם שמטופלים במקביל
+CONCURRENT_UPDATES = 32
+
+# הגדרות מחזור חיי תקופת ניסיון
+TRIAL_SCHEDULE_FILE = os.getenv('TRIAL_SCHEDULE_FILE', 'trial_schedule.db')
+TRIAL_REMINDER_OFFSET = timedelta(days=-1)  # יום לפני סיום הניסיון
+TRIAL_FINAL_OFFSET = timedelta(days=1)  # יום אחרי סיום הניסיון
+TRIAL_REMOVAL_OFFSET = timedelta(days=2)  # יומיים אחרי סיום הניסיון
+TRIAL_RETRY_DELAY = timedelta(minutes=5)  # המתנה לפני ניסיון חוזר - מוכפלת בכל כישלון
+TRIAL_RETRY_MAX_DELAY = timedelta(hours=6)
+TRIAL_MESSAGE_MAX_ATTEMPTS = 5  # תזכורת/הודעה סופית נזנחות אחרי 5 כישלונות, הסרה מנוסה עד שמצליחה
+
+# Google Sheets - כל הקריאות רצות ב-thread pool מוגבל ובקצב המכסה
+SHEETS_MAX_WORKERS = 4
+SHEETS_REQUESTS_PER_MINUTE = 60  # מכסת Sheets API לדקה למשתמש שירות
+SUBSCRIBER_SYNC_MINUTES = 10  # סנכרון סטטוסים שנערכו ידנית בגיליון לאינדקס המנויים
+REGISTRATION_APPEND_ATTEMPTS = 3  # ניסיונות כתיבת הרשמה לפני שהיא עוברת לניסיון חוזר ברקע
+REGISTRATION_RETRY_DELAY = 2  # שניות - מוכפל בכל ניסיון
+REGISTRATION_RETRY_MINUTES = 5
+
+# תמונת מצב להפעלה מחדש מהירה (warm start)
+STATE_SNAPSHOT_FILE = os.getenv('STATE_SNAPSHOT_FILE', 'bot_state.npz')
+STATE_SNAPSHOT_VERSION = 1
+STATE_SNAPSHOT_MAX_AGE = timedelta(days=7)  # תמונה ישנה יותר לא נטענת
+CONTENT_INTERVAL = timedelta(minutes=30)
+RECENT_SYMBOLS_LIMIT = 20  # סימבולים שפורסמו לאחרונה לא נבחרים שוב
+
+# לוגים - רשומות JSON שנכתבות מ-thread נפרד
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json או text
+LOG_RATE_LIMIT_BURST = 20  # הודעות מאותה תבנית בכל חלון
+LOG_RATE_LIMIT_WINDOW = 60  # שניות
+
+class JsonLogFormatter(logging.Formatter):
+    """רשומת JSON אחת לשורה - שדות extra (event, due...) נשמרים כשדות נפרדים"""
+
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED:
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """הפורמט הקריא הרגיל, עם מספר ההודעות שנחסמו בהגבלת הקצב"""
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+class LogRateLimiter(logging.Filter):
+    """עד burst הודעות מאותה תבנית בכל חלון זמן, ברמות מתחת ל-WARNING בלבד.
+
+    המפתח הוא תבנית ההודעה (לפני %-formatting), ולכן הודעות פר-משתמש נספרות יחד.
+    מספר ההודעות שנחסמו מדווח בהודעה הבאה שעוברת, או ב-flush כשהחלון נגמר.
+    """
+
+    def __init__(self, burst=LOG_RATE_LIMIT_BURST, window=LOG_RATE_LIMIT_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        # אזהרות ושגיאות תמיד עוברות
+        if record.levelno >= logging.WARNING:
+            return True
+        template = record.msg if isinstance(record.msg, str) else str(record.msg)
+        key = (record.name, record.levelno, template)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._windows) > 10000:
+                    self._windows.clear()
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                state = self._windows[key] = [now, 0, 0]
+            state[1] += 1
+            if state[1] > self.burst:
+                state[2] += 1
+                return False
+        return True
+
+    def flush(self, now=None, force=False):
+        """סגירת חלונות שהסתיימו - מחזיר רשומת סיכום לכל תבנית שנחסמו בה הודעות"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [key for key, state in self._windows.items() if force or now - state[0] >= self.window]
+            states = [(key, self._windows.pop(key)) for key in expired]
+
+        records = []
+        for (name, levelno, template), state in states:
+            if not state[2]:
+                continue
+            record = logging.LogRecord(
+                name, levelno, __file__, 0, "⏸️ Suppressed repeats of: %s", (template,), None
+            )
+            record.event = 'log_suppressed'
+            record.suppressed = state[2]
+            records.append(record)
+        return records
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """מכניס את הרשומה לתור כמו שהיא - העיצוב קורה ב-thread של ה-listener ולא בלולאה"""
+
+    def emit(self, record):
+        try:
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """listener שגם כותב את סיכומי החסימה של חלונות שנגמרו, פעם בשנייה"""
+
+    def __init__(self, log_queue, *handlers, limiter):
+        super().__init__(log_queue, *handlers)
+        self.limiter = limiter
+        self._next_flush = 0.0
+
+    def _flush_limiter(self, force=False):
+        for record in self.limiter.flush(force=force):
+            self.handle(record)
+
+    def dequeue(self, block):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_flush:
+                self._next_flush = now + 1
+                self._flush_limiter()
+            try:
+                return self.queue.get(block, timeout=self._next_flush - now)
+            except queue.Empty:
+                continue
+
+    def stop(self):
+        super().stop()
+        # חלונות שעדיין פתוחים בכיבוי
+        self._flush_limiter(force=True)
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """לוגים דרך תור - הלולאה רק מסננת ומכניסה רשומות, thread נפרד מעצב וכותב.
+
+    מחזיר את ה-QueueListener כדי לעצור אותו (ולרוקן את התור) בכיבוי.
+    """
+    handler = logging.StreamHandler()
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(TextLogFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    limiter = LogRateLimiter()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(limiter)
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    # httpx כותב שורת INFO לכל בקשה ל-Bot API, כולל כל getUpdates
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = LogQueueListener(log_queue, handler, limiter=limiter)
+    listener.start()
+    return listener
+
+class SystemClock:
+    """שעון אמיתי - ברירת המחדל של הבוט"""
+
+    def now(self):
+        return datetime.now()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+class VirtualClock:
+    """שעון מדומה לסימולציות - הזמן זז רק כשמקדמים אותו או כשישנים עליו"""
+
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance_to(self, when):
+        self.current = max(self.current, when)
+
+    async def sleep(self, seconds):
+        self.current += timedelta(seconds=seconds)
+        await asyncio.sleep(0)
+
+def check_environment():
+    """בדיקת משתני סביבה - נקרא רק בהפעלת הבוט, כך שכלים אחרים יכולים לייבא את המודול"""
+    if not BOT_TOKEN:
+        logger.error("❌ TELEGRAM_BOT_TOKEN environment variable not set!")
+        exit(1)
+    if not CHANNEL_ID:
+        logger.error("❌ CHANNEL_ID environment variable not set!")
+        exit(1)
+    if not GOOGLE_CREDENTIALS:
+        logger.error("❌ GOOGLE_CREDENTIALS environment variable not set!")
+        exit(1)
+    if not SPREADSHEET_ID:
+        logger.error("❌ SPREADSHEET_ID environment variable not set!")
+        exit(1)
+    if not TWELVE_DATA_API_KEY:
+        logger.error("❌ TWELVE_DATA_API_KEY environment variable not set!")
+        exit(1)
+
+    logger.info("✅ All environment variables are set")
+
+def format_price(price):
+    """עיצוב מחיר - גם למטבעות במחירים זעירים כמו SHIB"""
+    if price >= 1:
+        return f"{price:,.2f}"
+    return f"{price:.8f}".rstrip('0')
+
+class TwelveDataPriceStream:
+    """מנוי WebSocket יחיד לכל הסימבולים - המחיר האחרון של כל סימבול נשמר בזיכרון"""
+
+    def __init__(self, api_key, symbols, url=TWELVE_DATA_WS_URL, record_file=TWELVE_DATA_WS_RECORD_FILE,
+                 heartbeat_interval=10, max_backoff=60):
+        self.api_key = api_key
+        self.symbols = list(dict.fromkeys(symbols))
+        self.url = url
+        self.record_file = record_file
+        self.heartbeat_interval = heartbeat_interval
+        self.max_backoff = max_backoff
+        self.ticks = {}
+        self.connected = False
+        self.reconnects = 0
+        self._record_handle = None
+
+    def get_price(self, symbol, max_age=None):
+        """המחיר האחרון שהתקבל לסימבול, או None אם אין מחיר (או שהוא ישן מדי)"""
+        tick = self.ticks.get(symbol)
+        if not tick:
+            return None
+        if max_age is not None and datetime.now().timestamp() - tick['received_at'] > max_age:
+            return None
+        return tick['price']
+
+    def get_tick(self, symbol):
+        """הטיק האחרון המלא של סימבול"""
+        return self.ticks.get(symbol)
+
+    def _connect_url(self):
+        separator = '&' if '?' in self.url else '?'
+        return f"{self.url}{separator}apikey={self.api_key}"
+
+    def handle_message(self, raw):
+        """עדכון המחיר האחרון מהודעת price - שאר ההודעות מדווחות ללוג בלבד"""
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            logger.warning("Invalid price stream message: %r", raw)
+            return
+
+        event = message.get('event')
+        if event == 'price':
+            symbol = message.get('symbol')
+            try:
+                price = float(message['price'])
+            except (KeyError, TypeError, ValueError):
+                return
+            self.ticks[symbol] = {
+                'price': price,
+                'timestamp': message.get('timestamp'),
+                'day_volume': message.get('day_volume'),
+                'received_at': datetime.now().timestamp(),
+            }
+            if self.record_file:
+                self._record(raw)
+        elif event == 'subscribe-status':
+            fails = message.get('fails') or []
+            logger.info("📡 Price stream subscribed: %s symbols, %s failed", len(message.get('success') or []), len(fails))
+            if fails:
+                logger.warning("Price stream subscription failed for: %s", [f.get('symbol') for f in fails])
+
+    def _record(self, raw):
+        """הקלטת טיקים לקובץ JSONL - לשימוש חוזר ב-tick_replay_server.py"""
+        if self._record_handle is None:
+            self._record_handle = open(self.record_file, 'a', encoding='utf-8')
+        self._record_handle.write(raw.rstrip('\n') + '\n')
+        self._record_handle.flush()
+
+    async def _send_heartbeats(self, websocket):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await websocket.send(json.dumps({'action': 'heartbeat'}))
+
+    async def _session(self):
+        """חיבור בודד - מנוי לכל הסימבולים וקריאת הודעות עד לניתוק"""
+        async with websockets.connect(self._connect_url(), ping_interval=20) as websocket:
+            await websocket.send(json.dumps({
+                'action': 'subscribe',
+                'params': {'symbols': ','.join(self.symbols)}
+            }))
+            self.connected = True
+            heartbeat_task = asyncio.create_task(self._send_heartbeats(websocket))
+            try:
+                async for raw in websocket:
+                    self.handle_message(raw)
+            finally:
+                self.connected = False
+                heartbeat_task.cancel()
+
+    async def run(self):
+        """לולאת חיבור עם התחברות מחדש ומנוי מחדש אוטומטיים"""
+        backoff = 1
+        while True:
+            try:
+                logger.info("📡 Connecting price stream for %s symbols...", len(self.symbols))
+                await self._session()
+                logger.warning("Price stream closed by server")
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Price stream error: %s", e)
+
+            self.reconnects += 1
+            await asyncio.sleep(backoff + random.uniform(0, 1))
+            backoff = min(backoff * 2, self.max_backoff)
+
+BAR_DTYPE = np.dtype([
+    ('datetime', 'datetime64[s]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+])
+
+def parse_twelve_data_values(values):
+    """פענוח וקטורי של values מ-Twelve Data (מהחדש לישן) למערך ממוין מהישן לחדש"""
+    rows = [
+        (item['datetime'], item['open'], item['high'], item['low'], item['close'], item.get('volume') or 0)
+        for item in values
+    ]
+    # numpy ממיר את המחרוזות לתאריכים ולמספרים בבת אחת
+    bars = np.array(rows, dtype=BAR_DTYPE)[::-1]
+    return bars[np.argsort(bars['datetime'], kind='stable')]
+
+def bars_frame(timestamps, values):
+    """DataFrame בפורמט שהגרפים משתמשים בו (Open/High/Low/Close/Volume) ללא העתקת המערכים"""
+    return pd.DataFrame(
+        {
+            'Open': values[0],
+            'High': values[1],
+            'Low': values[2],
+            'Close': values[3],
+            'Volume': values[4],
+        },
+        index=pd.DatetimeIndex(timestamps),
+        copy=False
+    )
+
+def resample_bars(timestamps, values, interval, session=None):
+    """אגרגציה וקטורית של ברים (מהישן לחדש) לטווח זמן גס יותר - מחזיר (זמנים, ערכים).
+
+    session=(פתיחה, סגירה) בשניות מחצות בשעון הבורסה: ברים מחוץ למסחר נזרקים,
+    וברים תוך-יומיים נספרים מהפתיחה (4h: 09:30-13:30, 13:30-16:00).
+    בלי session (קריפטו) המסחר רציף והבאקטים מיושרים לחצות. שבוע מתחיל ביום שני.
+    """
+    seconds = timestamps.astype('datetime64[s]').astype(np.int64)
+    days, time_of_day = np.divmod(seconds, 86400)
+    if session is not None:
+        in_session = (time_of_day >= session[0]) & (time_of_day < session[1])
+        days, time_of_day, values = days[in_session], time_of_day[in_session], values[:, in_session]
+
+    step = TIMEFRAME_SECONDS[interval]
+    if step == TIMEFRAME_SECONDS['1week']:
+        keys = (days - (days + 3) % 7) * 86400  # 1970-01-01 היה יום חמישי
+    elif step == TIMEFRAME_SECONDS['1day']:
+        keys = days * 86400
+    else:
+        anchor = session[0] if session is not None else 0
+        keys = days * 86400 + anchor + (time_of_day - anchor) // step * step
+
+    if not len(keys):
+        return np.array([], dtype='datetime64[s]'), np.empty((values.shape[0], 0))
+
+    # תחילת כל באקט - הברים ממוינים ולכן כל באקט רציף
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    resampled = np.empty((values.shape[0], len(starts)))
+    resampled[0] = values[0, starts]
+    resampled[1] = np.maximum.reduceat(values[1], starts)
+    resampled[2] = np.minimum.reduceat(values[2], starts)
+    resampled[3] = values[3, ends]
+    resampled[4] = np.add.reduceat(values[4], starts)
+    return keys[starts].astype('datetime64[s]'), resampled
+
+def base_bars_per_bar(base, interval, asset_type='stock'):
+    """כמה ברים של base מרכיבים בר אחד של interval - להערכת outputsize"""
+    base_seconds = TIMEFRAME_SECONDS[base]
+    seconds = TIMEFRAME_SECONDS[interval]
+    if asset_type != 'stock' or base_seconds >= 86400 or seconds < 86400:
+        return max(1, -(-seconds // base_seconds))
+    # מניות - רק שעות המסחר, חמישה ימים בשבוע
+    per_day = -(-(STOCK_SESSION[1] - STOCK_SESSION[0]) // base_seconds)
+    return per_day * (5 if seconds >= TIMEFRAME_SECONDS['1week'] else 1)
+
+def format_timeframe_trends(frames):
+    """שורת מגמה לכל טווח זמן - שינוי הבר האחרון מול הקודם"""
+    parts = []
+    for interval, frame in frames.items():
+        if frame is None or len(frame) < 2 or not frame['Close'].iloc[-2]:
+            continue
+        change = (frame['Close'].iloc[-1] / frame['Close'].iloc[-2] - 1) * 100
+        parts.append(f"{interval} {'📈' if change >= 0 else '📉'} {change:+.1f}%")
+    return " | ".join(parts)
+
+class BarRingBuffer:
+    """באפר טבעתי בגודל קבוע לברים של סימבול אחד.
+
+    כל בר נכתב פעמיים (במקום i ובמקום i + capacity), כך שהחלון האחרון תמיד רציף
+    בזיכרון ואפשר להחזיר ממנו views ללא העתקה. view תקף עד ההוספה הבאה.
+    """
+
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, capacity=BAR_STORE_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype='datetime64[s]')
+        self.values = np.zeros((len(self.FIELDS), 2 * capacity), dtype=np.float64)
+        self.head = 0  # המקום הבא לכתיבה
+        self.size = 0
+        self.updated_at = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    @property
+    def last_timestamp(self):
+        return self.timestamps[self.head + self.capacity - 1] if self.size else None
+
+    def _window(self, last=None):
+        size = self.size if last is None else min(last, self.size)
+        end = self.head + self.capacity
+        return slice(end - size, end)
+
+    def append(self, timestamp, open_, high, low, close, volume=0.0):
+        """הוספת בר ב-O(1) - בר עם אותו זמן כמו האחרון מעדכן אותו"""
+        timestamp = np.datetime64(timestamp, 's')
+        if self.size and timestamp <= self.last_timestamp:
+            if timestamp < self.last_timestamp:
+                return
+            position = (self.head - 1) % self.capacity
+        else:
+            position = self.head
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        for pos in (position, position + self.capacity):
+            self.timestamps[pos] = timestamp
+            self.values[:, pos] = (open_, high, low, close, volume)
+        self.updated_at = datetime.now()
+
+    def extend(self, bars):
+        """הוספה וקטורית של ברים ממוינים (BAR_DTYPE) - רק ברים חדשים מהאחרון נכתבים"""
+        if self.size:
+            last = self.last_timestamp
+            same = bars[bars['datetime'] == last]
+            if len(same):
+                # עדכון הבר האחרון (למשל נר היום שעדיין נסגר)
+                position = (self.head - 1) % self.capacity
+                for pos in (position, position + self.capacity):
+                    self.values[:, pos] = [same[-1][field] for field in self.FIELDS]
+            bars = bars[bars['datetime'] > last]
+        bars = bars[-self.capacity:]
+        count = len(bars)
+        if count:
+            positions = (self.head + np.arange(count)) % self.capacity
+            for offset in (0, self.capacity):
+                self.timestamps[positions + offset] = bars['datetime']
+                for row, field in enumerate(self.FIELDS):
+                    self.values[row, positions + offset] = bars[field]
+            self.head = (self.head + count) % self.capacity
+            self.size = min(self.size + count, self.capacity)
+        self.updated_at = datetime.now()
+
+    def view(self, field, last=None):
+        """view ללא העתקה של עמודה - מהישן לחדש"""
+        window = self._window(last)
+        if field == 'datetime':
+            return self.timestamps[window]
+        return self.values[self.FIELDS.index(field), window]
+
+    def restore(self, timestamps, values, updated_at=None):
+        """טעינת ברים שמורים (מהישן לחדש) לבאפר, כולל זמן העדכון המקורי"""
+        bars = np.zeros(len(timestamps), dtype=BAR_DTYPE)
+        bars['datetime'] = timestamps
+        for row, field in enumerate(self.FIELDS):
+            bars[field] = values[row]
+        self.extend(bars)
+        self.updated_at = updated_at
+
+    def is_fresh(self, ttl):
+        return self.size > 0 and self.updated_at is not None and datetime.now() - self.updated_at < ttl
+
+    def arrays(self, last=None):
+        """(זמנים, ערכים בצורת 5xN) - views ללא העתקה, מהישן לחדש"""
+        window = self._window(last)
+        return self.timestamps[window], self.values[:, window]
+
+    def to_frame(self, last=None):
+        """DataFrame בפורמט שהגרפים משתמשים בו, בנוי על views של הבאפר"""
+        return bars_frame(*self.arrays(last))
+
+class BarStore:
+    """ברים אחרונים לכל הסימבולים בזיכרון - באפר טבעתי בגודל קבוע לכל סימבול"""
+
+    def __init__(self, capacity=BAR_STORE_CAPACITY):
+        self.capacity = capacity
+        self.buffers = {}
+
+    def get(self, symbol):
+        return self.buffers.get(symbol)
+
+    def buffer(self, symbol):
+        if symbol not in self.buffers:
+            self.buffers[symbol] = BarRingBuffer(self.capacity)
+        return self.buffers[symbol]
+
+    def update_from_twelve_data(self, symbol, values):
+        """פענוח תשובת time_series ישירות לבאפר של הסימבול"""
+        bars = self.buffer(symbol)
+        bars.extend(parse_twelve_data_values(values))
+        return bars
+
+    def export_arrays(self):
+        """ברים לכל סימבול לתמונת המצב - (סימבול, זמנים, ערכים, זמן עדכון)"""
+        return [
+            (
+                symbol,
+                bars.view('datetime').copy(),
+                np.stack([bars.view(field) for field in BarRingBuffer.FIELDS]),
+                bars.updated_at,
+            )
+            for symbol, bars in self.buffers.items() if len(bars)
+        ]
+
+    def restore(self, symbol, timestamps, values, updated_at=None):
+        """טעינת ברים שמורים אחרי אימות צורה וסדר - False אם לא תקינים"""
+        if values.shape != (len(BarRingBuffer.FIELDS), len(timestamps)):
+            return False
+        if np.any(np.diff(timestamps) <= np.timedelta64(0, 's')):
+            return False
+        self.buffer(symbol).restore(timestamps, values, updated_at)
+        return True
+
+    @property
+    def nbytes(self):
+        return sum(bars.nbytes for bars in self.buffers.values())
+
 class TwelveDataAPI:
-    def __init__(self, api_key):
+    def __init__(self, api_key, price_stream=None):
         self.api_key = api_key
         self.base_url = "https://api.twelvedata.com"
+        self.price_stream = price_stream
+        self.bar_store = BarStore()
+        # מאגר לכל טווח זמן שנמשך מה-API - טווחים גסים יותר מחושבים מקומית
+        self.bar_stores = {'1day': self.bar_store}
+        # אזור הזמן של הבורסה לכל סימבול (מ-meta של time_series) - זמני הברים נמדדים בו
+        self.exchange_timezones = {}
+        # המשיכות רצות ב-thread (asyncio.to_thread) - כל גישה לבאפרים עוברת דרך המנעול,
+        # ומה שיוצא החוצה הוא עותק ולא view שמשתנה ב-append הבא
+        self._store_lock = threading.Lock()
+    
+    def store_for(self, interval):
+        with self._store_lock:
+            if interval not in self.bar_stores:
+                capacity = BAR_STORE_CAPACITY if TIMEFRAME_SECONDS[interval] >= 86400 else INTRADAY_BAR_CAPACITY
+                self.bar_stores[interval] = BarStore(capacity)
+            return self.bar_stores[interval]
+    
+    def copy_arrays(self, bars, last=None):
+        """עותק של (זמנים, ערכים) מהבאפר - בטוח לשימוש אחרי שה-thread ממשיך להוסיף ברים"""
+        with self._store_lock:
+            timestamps, values = bars.arrays(last)
+            return timestamps.copy(), values.copy()
+    
+    def get_bars(self, symbol, interval='1day', outputsize=CHART_BARS):
+        """באפר הברים של סימבול - מהמאגר אם עדכני, אחרת משיכת הברים החסרים בלבד.
+
+        הזמנים בשעון הבורסה (ברירת המחדל של Twelve Data) - גבולות המסחר של מניות נשענים על כך.
+        """
+        store = self.store_for(interval)
+        outputsize = min(outputsize, store.capacity)
+        with self._store_lock:
+            bars = store.get(symbol)
+            if bars is not None and bars.is_fresh(BAR_CACHE_TTL) and len(bars) >= outputsize:
+                return bars
+            last_timestamp = bars.last_timestamp if bars is not None and len(bars) >= outputsize else None
+        
+        # כשיש מספיק היסטוריה בזיכרון מושכים רק את הברים החסרים - הזמן שעבר נמדד בשעון הבורסה
+        full_outputsize = outputsize
+        exchange_tz = self.exchange_timezones.get(symbol)
+        if last_timestamp is not None and exchange_tz is not None:
+            exchange_now = datetime.now(exchange_tz).replace(tzinfo=None)
+            elapsed = (np.datetime64(exchange_now, 's') - last_timestamp).astype(np.int64)
+            outputsize = int(min(outputsize, max(elapsed // TIMEFRAME_SECONDS[interval] + 2, 2)))
+        
+        data = self._fetch_time_series(symbol, interval, outputsize)
+        if not data.get('values'):
+            logger.error("No Twelve Data %s bars for %s: %s", interval, symbol, data.get('message', 'empty response'))
+            return None
+        
+        # בלי חפיפה עם הבר האחרון במאגר נשאר פער - משיכה מלאה במקום חור קבוע בבאפר
+        if outputsize < full_outputsize and np.datetime64(data['values'][-1]['datetime'], 's') > last_timestamp:
+            logger.warning("⚠️ Gap in cached %s bars for %s - refetching %s bars", interval, symbol, full_outputsize)
+            data = self._fetch_time_series(symbol, interval, full_outputsize)
+            if not data.get('values'):
+                logger.error("No Twelve Data %s bars for %s: %s", interval, symbol, data.get('message', 'empty response'))
+                return None
+        
+        with self._store_lock:
+            bars = store.update_from_twelve_data(symbol, data['values'])
+        logger.info("✅ Twelve Data %s bars retrieved for %s: %s new, %s cached", interval, symbol, len(data['values']), len(bars))
+        return bars
+    
+    def _fetch_time_series(self, symbol, interval, outputsize):
+        url = f"{self.base_url}/time_series"
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'outputsize': outputsize,
+            'apikey': self.api_key
+        }
+        
+        response = requests.get(url, params=params)
+        data = response.json()
+        
+        timezone_name = (data.get('meta') or {}).get('exchange_timezone')
+        if timezone_name:
+            try:
+                self.exchange_timezones[symbol] = ZoneInfo(timezone_name)
+            except (KeyError, ValueError):
+                logger.warning("Unknown exchange timezone for %s: %s", symbol, timezone_name)
+        return data
+    
+    def get_timeframes(self, symbol, intervals, asset_type='stock', count=CHART_BARS):
+        """ברים בכמה טווחי זמן מקריאת API אחת - {interval: DataFrame}.
+        
+        נמשך ונשמר רק הטווח העדין ביותר; הטווחים הגסים נבנים ממנו ב-resample_bars.
+        """
+        base = min(intervals, key=TIMEFRAME_SECONDS.__getitem__)
+        coarsest = max(intervals, key=TIMEFRAME_SECONDS.__getitem__)
+        try:
+            bars = self.get_bars(symbol, base, count * base_bars_per_bar(base, coarsest, asset_type))
+        except Exception as e:
+            logger.error("Twelve Data %s error for %s: %s", base, symbol, e)
+            return {}
+        if bars is None:
+            return {}
+        
+        session = STOCK_SESSION if asset_type == 'stock' and TIMEFRAME_SECONDS[base] < 86400 else None
+        timestamps, values = self.copy_arrays(bars)
+        frames = {}
+        for interval in intervals:
+            if interval == base:
+                frames[interval] = bars_frame(timestamps[-count:], values[:, -count:])
+            else:
+                resampled_timestamps, resampled_values = resample_bars(timestamps, values, interval, session)
+                frames[interval] = bars_frame(resampled_timestamps[-count:], resampled_values[:, -count:])
+        return frames
     
     def get_stock_data(self, symbol):
-        """קבלת נתוני מניה מ-Twelve Data API עם requests"""
+        """קבלת נתוני מניה - מהמאגר בזיכרון אם עדכני, אחרת מ-Twelve Data API"""
+        try:
+            bars = self.get_bars(symbol, '1day', CHART_BARS)
+            if bars is not None:
+                return bars_frame(*self.copy_arrays(bars, CHART_BARS))
+            return self.get_stock_quote(symbol)
+                
+        except Exception as e:
+            logger.error("Twelve Data error for %s: %s", symbol, e)
+            return self.get_stock_quote(symbol)
+    
+    def export_bars(self):
+        """ברים מכל טווחי הזמן לתמונת המצב - (טווח, סימבול, זמנים, ערכים, זמן עדכון)"""
+        with self._store_lock:
+            return [
+                (interval, *item)
+                for interval, store in self.bar_stores.items()
+                for item in store.export_arrays()
+            ]
+    
+    def restore_bars(self, interval, symbol, timestamps, values, updated_at=None):
+        if interval not in TIMEFRAME_SECONDS:
+            return False
+        store = self.store_for(interval)
+        with self._store_lock:
+            return store.restore(symbol, timestamps, values, updated_at)
+    
+    def get_batch_bars(self, symbols, interval=SIGNAL_TRACKING_INTERVAL, outputsize=50):
+        """ברים אחרונים לכמה סימבולים בקריאה אחת - {symbol: [bar, ...]} ממוין מהישן לחדש, זמנים ב-UTC"""
+        if not symbols:
+            return {}
         try:
             url = f"{self.base_url}/time_series"
             params = {
-                'symbol': symbol,
-                'interval': '1day',
-                'outputsize': 30,
+                'symbol': ','.join(symbols),
+                'interval': interval,
+                'outputsize': outputsize,
+                'timezone': 'UTC',
                 'apikey': self.api_key
             }
             
             response = requests.get(url, params=params)
             data = response.json()
             
-            if 'values' in data and data['values']:
-                df_data = []
-                for item in data['values']:
-                    df_data.append({
-                        'Open': float(item['open']),
-                        'High': float(item['high']),
-                        'Low': float(item['low']),
-                        'Close': float(item['close']),
-                        'Volume': int(item['volume'])
-                    })
-                
-                df = pd.DataFrame(df_data)
-                dates = [datetime.strptime(item['datetime'], '%Y-%m-%d') for item in data['values']]
-                df.index = pd.DatetimeIndex(dates)
-                df = df.sort_index()
-                
-                logger.info(f"✅ Twelve Data retrieved for {symbol}: {len(df)} days")
-                return df
-            else:
-                logger.error(f"No Twelve Data for {symbol}")
-                return self.get_stock_quote(symbol)
-                
+            # סימבול יחיד מוחזר ללא קינון לפי סימבול
+            if len(symbols) == 1:
+                data = {symbols[0]: data}
+            
+            bars = {}
+            for symbol in symbols:
+                series = data.get(symbol) or {}
+                if not series.get('values'):
+                    logger.warning("No batch bars for %s: %s", symbol, series.get('message', 'empty response'))
+                    continue
+                bars[symbol] = [
+                    {
+                        'datetime': item['datetime'],
+                        'open': float(item['open']),
+                        'high': float(item['high']),
+                        'low': float(item['low']),
+                        'close': float(item['close']),
+                    }
+                    for item in reversed(series['values'])
+                ]
+            
+            logger.info("✅ Twelve Data batch bars retrieved for %s/%s symbols", len(bars), len(symbols))
+            return bars
+            
         except Exception as e:
-            logger.error(f"Twelve Data error for {symbol}: {e}")
-            return self.get_stock_quote(symbol)
-    
-    def get_stock_quote(self, symbol):
-        """קבלת מחיר נוכחי מ-Twelve Data"""
+            logger.error("Twelve Data batch error: %s", e)
+            return {}
+
+    def get_live_price(self, symbol):
+        """מחיר טרי מהזרם החי - None אם אין טיק או שהוא ישן מ-PRICE_STREAM_MAX_AGE"""
+        if not self.price_stream:
+            return None
+        return self.price_stream.get_price(symbol, max_age=PRICE_STREAM_MAX_AGE)
+
+    def get_price(self, symbol):
+        """מחיר נוכחי - מהזרם החי אם הוא טרי, אחרת קריאת REST ל-/price"""
+        live_price = self.get_live_price(symbol)
+        if live_price is not None:
+            return live_price
         try:
             url = f"{self.base_url}/price"
             params = {
@@ -109,47 +977,694 @@ class TwelveDataAPI:
             
             response = requests.get(url, params=params)
             price_data = response.json()
-            
             if 'price' in price_data:
-                current_price = float(price_data['price'])
-                
+                return float(price_data['price'])
+            logger.error("No price data for %s", symbol)
+            return None
+        
+        except Exception as e:
+            logger.error("Twelve Data price error for %s: %s", symbol, e)
+            return None
+
+    def get_stock_quote(self, symbol):
+        """קבלת מחיר נוכחי מ-Twelve Data"""
+        try:
+            current_price = self.get_price(symbol)
+            
+            if current_price is not None:
                 # יצירת DataFrame פשוט עם המחיר הנוכחי
-                df_data = []
-                for i in range(30):
-                    date = datetime.now() - timedelta(days=29-i)
-                    price_variation = random.uniform(0.98, 1.02)
-                    base_price = current_price * price_variation
-                    
-                    df_data.append({
-                        'Open': base_price * random.uniform(0.995, 1.005),
-                        'High': base_price * random.uniform(1.00, 1.02),
-                        'Low': base_price * random.uniform(0.98, 1.00),
-                        'Close': base_price,
-                        'Volume': random.randint(1000000, 10000000)
-                    })
+                base_price = current_price * np.random.uniform(0.98, 1.02, CHART_BARS)
+                base_price[-1] = current_price
                 
-                df = pd.DataFrame(df_data)
-                dates = [datetime.now() - timedelta(days=29-i) for i in range(30)]
-                df.index = pd.DatetimeIndex(dates)
-                df.iloc[-1, df.columns.get_loc('Close')] = current_price
+                df = pd.DataFrame(
+                    {
+                        'Open': base_price * np.random.uniform(0.995, 1.005, CHART_BARS),
+                        'High': base_price * np.random.uniform(1.00, 1.02, CHART_BARS),
+                        'Low': base_price * np.random.uniform(0.98, 1.00, CHART_BARS),
+                        'Close': base_price,
+                        'Volume': np.random.randint(1000000, 10000000, CHART_BARS)
+                    },
+                    index=pd.date_range(end=datetime.now(), periods=CHART_BARS, freq='D')
+                )
                 
-                logger.info(f"✅ Twelve Data quote used for {symbol}: ${current_price}")
+                logger.info("✅ Twelve Data quote used for %s: $%s", symbol, current_price)
                 return df
             else:
-                logger.error(f"No price data for {symbol}")
                 return None
                 
         except Exception as e:
-            logger.error(f"Twelve Data quote error for {symbol}: {e}")
+            logger.error("Twelve Data quote error for %s: %s", symbol, e)
             return None
 
-class PeakTradeBot:
+class TrialLifecycleSchedule:
+    """אינדקס אירועי תקופת ניסיון בטבלת SQLite לפי זמן יעד - כתיבה רק של האירועים שהשתנו"""
+
+    REMINDER = 'reminder'
+    FINAL = 'final'
+    REMOVAL = 'removal'
+
+    OFFSETS = {
+        REMINDER: TRIAL_REMINDER_OFFSET,
+        FINAL: TRIAL_FINAL_OFFSET,
+        REMOVAL: TRIAL_REMOVAL_OFFSET,
+    }
+
+    SCHEMA_VERSION = 2  # נשמר ב-user_version אחרי בנייה ראשונה מהגיליון
+
+    def __init__(self, path=TRIAL_SCHEDULE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path or ':memory:')
+        # טבלה מגרסה אחרת נבנית מחדש מהגיליון
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS trial_events")
+        self.conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS trial_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                due_at TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                trial_end TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_trial_events_due_at ON trial_events (due_at, id);
+            CREATE INDEX IF NOT EXISTS idx_trial_events_user ON trial_events (user_id, trial_end);
+            CREATE TABLE IF NOT EXISTS pending_registrations (
+                user_id INTEGER PRIMARY KEY,
+                sheet_row TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        self.conn.commit()
+        self._count = self.conn.execute("SELECT COUNT(*) FROM trial_events").fetchone()[0]
+        self._wakeup = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def wakeup(self):
+        """Event שמעיר את ה-dispatcher כשנוסף אירוע מוקדם יותר"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _push(self, due_at, user_id, kind, trial_end, attempts=0):
+        self.conn.execute(
+            "INSERT INTO trial_events (due_at, user_id, kind, trial_end, attempts) VALUES (?, ?, ?, ?, ?)",
+            (due_at.isoformat(" ", "seconds"), int(user_id), kind, trial_end.isoformat(" ", "seconds"), attempts)
+        )
+        self._count += 1
+
+    def schedule_trial(self, user_id, trial_end, now=None):
+        """תזמון אירועי התזכורת, ההודעה הסופית וההסרה של משתמש"""
+        now = now or datetime.now()
+        final_at = trial_end + TRIAL_FINAL_OFFSET
+        removal_at = trial_end + TRIAL_REMOVAL_OFFSET
+
+        # שלב שכבר עבר ויש אחריו שלב מאוחר יותר שגם עבר - אין טעם לשלוח אותו
+        if now < final_at:
+            self._push(trial_end + TRIAL_REMINDER_OFFSET, user_id, self.REMINDER, trial_end)
+        if now < removal_at:
+            self._push(final_at, user_id, self.FINAL, trial_end)
+        self._push(removal_at, user_id, self.REMOVAL, trial_end)
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def next_due(self):
+        """מועד האירוע הקרוב ביותר, או None אם האינדקס ריק"""
+        row = self.conn.execute("SELECT MIN(due_at) FROM trial_events").fetchone()
+        return datetime.fromisoformat(row[0]) if row[0] else None
+
+    def pop_due(self, now=None):
+        """שליפת כל האירועים שהגיע זמנם - רק הם נוגעים בגיליון ובטבלה.
+
+        המחיקה נשמרת רק ב-save() בסוף הריצה, ואירוע שנכשל חוזר לתור דרך reschedule.
+        """
+        now_str = (now or datetime.now()).isoformat(" ", "seconds")
+        rows = self.conn.execute(
+            "SELECT id, due_at, user_id, kind, trial_end, attempts FROM trial_events "
+            "WHERE due_at <= ? ORDER BY due_at, id",
+            (now_str,)
+        ).fetchall()
+        if not rows:
+            return []
+
+        self.conn.execute("DELETE FROM trial_events WHERE due_at <= ?", (now_str,))
+        self._count -= len(rows)
+
+        due_events = []
+        for _, due_str, user_id, kind, trial_end_str, attempts in rows:
+            due_events.append({
+                'due_at': datetime.fromisoformat(due_str),
+                'user_id': user_id,
+                'kind': kind,
+                'trial_end': datetime.fromisoformat(trial_end_str),
+                'attempts': attempts,
+            })
+        return due_events
+
+    def reschedule(self, event, due_at, attempts=None):
+        """החזרת אירוע לתור למועד מאוחר יותר"""
+        attempts = event.get('attempts', 0) if attempts is None else attempts
+        self._push(due_at, event['user_id'], event['kind'], event['trial_end'], attempts)
+
+    def has_trial(self, user_id, trial_end, in_flight=()):
+        """האם נשאר בתור (או בטיפול כרגע) אירוע כלשהו לתקופת הניסיון הזו - ההסרה היא תמיד האחרונה"""
+        if (int(user_id), trial_end.isoformat(" ", "seconds")) in in_flight:
+            return True
+        return self.conn.execute(
+            "SELECT 1 FROM trial_events WHERE user_id = ? AND trial_end = ? LIMIT 1",
+            (int(user_id), trial_end.isoformat(" ", "seconds"))
+        ).fetchone() is not None
+
+    def ensure_trial(self, user_id, trial_end, now=None, in_flight=()):
+        """תזמון תקופת ניסיון רק אם אין לה אירועים בתור - מחזיר True אם נוספו"""
+        if self.has_trial(user_id, trial_end, in_flight):
+            return False
+        self.schedule_trial(user_id, trial_end, now)
+        return True
+
+    @staticmethod
+    def active_trials(records):
+        """(user_id, trial_end) לכל משתמש שהרשומה האחרונה שלו בגיליון היא trial_active תקינה"""
+        latest = {}
+        for record in records:
+            if record.get('telegram_user_id'):
+                latest[str(record['telegram_user_id'])] = record
+        for user_id, record in latest.items():
+            if record.get('payment_status') != 'trial_active':
+                continue
+            trial_end_str = record.get('trial_end_date')
+            if not trial_end_str:
+                continue
+            try:
+                yield int(user_id), datetime.strptime(trial_end_str, "%Y-%m-%d %H:%M:%S")
+            except ValueError as ve:
+                logger.error("Invalid date format for user %s: %s - %s", user_id, trial_end_str, ve)
+
+    def rebuild_from_records(self, records, now=None):
+        """בניית האינדקס מרשומות הגיליון - פעם אחת, כשהטבלה עוד לא נבנתה"""
+        self.conn.execute("DELETE FROM trial_events")
+        self._count = 0
+        for user_id, trial_end in self.active_trials(records):
+            self.schedule_trial(user_id, trial_end, now)
+        # הרשמות שעוד לא הגיעו לגיליון שומרות על האירועים שלהן
+        for user_id, row, _ in self.pending_registrations():
+            self.ensure_trial(user_id, datetime.fromisoformat(row[6]), now)
+        self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def reconcile_with_records(self, records, now=None, in_flight=()):
+        """השלמת תקופות ניסיון פעילות בגיליון שאין להן אירועים בתור (הארכה או החזרה ידנית ל-trial_active).
+
+        אירועים קיימים לא משוכפלים. מחזיר כמה תקופות נוספו.
+        """
+        scheduled = {
+            (user_id, trial_end) for user_id, trial_end in
+            self.conn.execute("SELECT DISTINCT user_id, trial_end FROM trial_events")
+        } | set(in_flight)
+        added = 0
+        for user_id, trial_end in self.active_trials(records):
+            if (user_id, trial_end.isoformat(" ", "seconds")) not in scheduled:
+                self.schedule_trial(user_id, trial_end, now)
+                added += 1
+        return added
+
+    def add_pending_registration(self, user_id, row):
+        """שמירת שורת הגיליון של הרשמה לפני הכתיבה - נשמרת יחד עם האירועים ב-save()"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pending_registrations (user_id, sheet_row, attempts) VALUES (?, ?, 0)",
+            (int(user_id), json.dumps(row))
+        )
+
+    def registration_failed(self, user_id):
+        """ספירת ניסיון כתיבה שנכשל - מחזיר את מספר הכישלונות עד כה"""
+        self.conn.execute(
+            "UPDATE pending_registrations SET attempts = attempts + 1 WHERE user_id = ?", (int(user_id),)
+        )
+        row = self.conn.execute(
+            "SELECT attempts FROM pending_registrations WHERE user_id = ?", (int(user_id),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def complete_registration(self, user_id):
+        self.conn.execute("DELETE FROM pending_registrations WHERE user_id = ?", (int(user_id),))
+
+    def is_registration_pending(self, user_id):
+        return self.conn.execute(
+            "SELECT 1 FROM pending_registrations WHERE user_id = ?", (int(user_id),)
+        ).fetchone() is not None
+
+    def pending_registrations(self):
+        """(user_id, שורת גיליון, כישלונות) לכל הרשמה שעוד לא נכתבה לגיליון"""
+        return [
+            (user_id, json.loads(sheet_row), attempts) for user_id, sheet_row, attempts in
+            self.conn.execute("SELECT user_id, sheet_row, attempts FROM pending_registrations ORDER BY user_id")
+        ]
+
+    def save(self):
+        """commit של כל השינויים מאז השמירה הקודמת בטרנזקציה אחת"""
+        self.conn.commit()
+
+    def load(self):
+        """האם הטבלה כבר נבנתה - מחזיר False אם צריך לבנות אותה מהגיליון"""
+        if not self.path:
+            return False
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("❌ Error loading trial schedule from %s: %s", self.path, e)
+            return False
+        return version == self.SCHEMA_VERSION
+
+    def close(self):
+        self.conn.close()
+
+class SheetsGateway:
+    """גישה ל-Google Sheets מחוץ ללולאת האירועים.
+
+    קריאות gspread רצות ב-executor מוגבל (אפשר להזריק executor אחר), כל קריאה צורכת
+    אסימון ממכסה לדקה, וכתיבות לאותה שורה מבוצעות אחת אחרי השנייה.
+    inline=True מריץ את הקריאות ישירות בלולאה - רק לגיליון בזיכרון (סימולציות).
+    """
+
+    def __init__(self, worksheet, max_workers=SHEETS_MAX_WORKERS,
+                 requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, executor=None, inline=False):
+        self.worksheet = worksheet
+        self.inline = inline
+        self.executor = None
+        if not inline:
+            self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        self.requests_per_minute = requests_per_minute
+        self._tokens = float(requests_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._quota_lock = None
+        self._row_locks = {}
+        self._row_lock_users = collections.Counter()
+        self.calls = collections.Counter()
+
+    async def _acquire_quota(self):
+        """דלי אסימונים - פרץ של עד מכסה שלמה, ואחריו קצב קבוע"""
+        if not self.requests_per_minute:
+            return
+        if self._quota_lock is None:
+            self._quota_lock = asyncio.Lock()
+        async with self._quota_lock:
+            while True:
+                now = time.monotonic()
+                refill = (now - self._refilled_at) * self.requests_per_minute / 60
+                self._tokens = min(self.requests_per_minute, self._tokens + refill)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * 60 / self.requests_per_minute)
+
+    async def _call(self, name, *args, **kwargs):
+        await self._acquire_quota()
+        self.calls[name] += 1
+        func = functools.partial(getattr(self.worksheet, name), *args, **kwargs)
+        if self.inline:
+            return func()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func)
+
+    @contextlib.asynccontextmanager
+    async def row_lock(self, row):
+        """נעילה לשורה בגיליון - הנעילה נמחקת כשאין מי שמחכה לה"""
+        lock = self._row_locks.setdefault(row, asyncio.Lock())
+        self._row_lock_users[row] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._row_lock_users[row] -= 1
+            if not self._row_lock_users[row]:
+                del self._row_lock_users[row]
+                del self._row_locks[row]
+
+    async def get_all_records(self):
+        return await self._call('get_all_records')
+
+    async def row_values(self, row):
+        return await self._call('row_values', row)
+
+    async def col_values(self, col):
+        return await self._call('col_values', col)
+
+    async def findall(self, query, in_column=None):
+        return await self._call('findall', query, in_column=in_column)
+
+    async def append_row(self, values):
+        return await self._call('append_row', values)
+
+    async def update_row(self, row, values_by_column):
+        """עדכון כמה תאים באותה שורה בקריאה אחת - {עמודה: ערך}"""
+        cells = [gspread.Cell(row, col, value) for col, value in values_by_column.items()]
+        async with self.row_lock(row):
+            return await self._call('update_cells', cells)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+class SubscriberIndex:
+    """אינדקס מנויים בזיכרון - user_id -> (שורה, סטטוס, סיום ניסיון), במקום קריאת כל הגיליון בכל /start"""
+
+    ACTIVE_STATUSES = ('trial_active', 'paid_subscriber')
+
     def __init__(self):
+        self.entries = {}
+        self.row_count = 0  # שורות בגיליון כולל הכותרת - לאימות מול הגיליון
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rebuild(self, records):
+        """בנייה מ-get_all_records - השורה האחרונה של כל משתמש קובעת.
+
+        רשומות שהכתיבה שלהן עדיין ממתינה (row=None) נשמרות אם הן לא בגיליון עדיין.
+        """
+        pending = {user_id: entry for user_id, entry in self.entries.items() if entry[0] is None}
+        self.entries = {}
+        for offset, record in enumerate(records):
+            try:
+                user_id = int(record.get('telegram_user_id'))
+            except (TypeError, ValueError):
+                continue
+            self.entries[user_id] = (offset + 2, record.get('payment_status', ''), record.get('trial_end_date', ''))
+        for user_id, entry in pending.items():
+            self.entries.setdefault(user_id, entry)
+        self.row_count = len(records) + 1
+
+    def apply_statuses(self, statuses):
+        """עדכון סטטוסים מעמודת payment_status (col_values(8), כולל הכותרת) - מחזיר כמה השתנו"""
+        changed = 0
+        for user_id, (row, status, trial_end) in self.entries.items():
+            if row and row <= len(statuses) and statuses[row - 1] != status:
+                self.entries[user_id] = (row, statuses[row - 1], trial_end)
+                changed += 1
+        return changed
+
+    def get(self, user_id):
+        return self.entries.get(int(user_id))
+
+    def is_active(self, user_id):
+        entry = self.get(user_id)
+        return entry is not None and entry[1] in self.ACTIVE_STATUSES
+
+    def add(self, user_id, row, status, trial_end=''):
+        """row=None - רשומה שהכתיבה שלה לגיליון עדיין ממתינה"""
+        self.entries[int(user_id)] = (row, status, trial_end)
+        if row:
+            self.row_count = max(self.row_count, row)
+
+    def discard(self, user_id):
+        self.entries.pop(int(user_id), None)
+
+    def set_status(self, user_id, status):
+        entry = self.get(user_id)
+        if entry is not None:
+            self.entries[int(user_id)] = (entry[0], status, entry[2])
+
+    def to_rows(self):
+        return [[user_id, row, status, trial_end] for user_id, (row, status, trial_end) in self.entries.items()]
+
+    def load_rows(self, rows, row_count):
+        # רשומה שהכתיבה שלה לא הסתיימה לפני הכיבוי לא נטענת - אחרת המשתמש נחסם כ"פעיל"
+        self.entries = {
+            int(user_id): (int(row), status, trial_end)
+            for user_id, row, status, trial_end in rows
+            if row
+        }
+        self.row_count = row_count
+
+def appended_row_index(response):
+    """מספר השורה שנוספה, מתוך תשובת append_row (למשל 'Sheet1!A12:K12')"""
+    try:
+        first_cell = response['updates']['updatedRange'].split('!')[-1].split(':')[0]
+        return int(''.join(ch for ch in first_cell if ch.isdigit()))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class StateSnapshot:
+    """תמונת מצב דחוסה של הבוט (npz ללא pickle) - מטא-דאטה ב-JSON ומערכי ברים לכל סימבול"""
+
+    def __init__(self, path=STATE_SNAPSHOT_FILE):
+        self.path = path
+
+    def write(self, meta, bars):
+        """כתיבה אטומית - bars הוא רשימת (טווח, סימבול, זמנים, ערכים, זמן עדכון)"""
+        if not self.path:
+            return
+        arrays = {}
+        meta = dict(meta, version=STATE_SNAPSHOT_VERSION, bars=[])
+        for i, (interval, symbol, timestamps, values, updated_at) in enumerate(bars):
+            arrays[f'bars_{i}_datetime'] = timestamps
+            arrays[f'bars_{i}_values'] = values
+            meta['bars'].append({
+                'interval': interval,
+                'symbol': symbol,
+                'updated_at': updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
+            })
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def read(self, now=None):
+        """קריאה ואימות - מחזיר (meta, bars) או None אם אין תמונה תקפה"""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        now = now or datetime.now()
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+                if meta.get('version') != STATE_SNAPSHOT_VERSION:
+                    logger.warning("⚠️ State snapshot version %s ignored", meta.get('version'))
+                    return None
+                created_at = datetime.strptime(meta['created_at'], "%Y-%m-%d %H:%M:%S")
+                if now - created_at > STATE_SNAPSHOT_MAX_AGE:
+                    logger.warning("⚠️ State snapshot from %s is too old - ignored", created_at)
+                    return None
+                bars = []
+                for i, item in enumerate(meta['bars']):
+                    updated_at = item.get('updated_at')
+                    bars.append((
+                        item.get('interval', '1day'),
+                        item['symbol'],
+                        data[f'bars_{i}_datetime'],
+                        data[f'bars_{i}_values'],
+                        datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S") if updated_at else None,
+                    ))
+            return meta, bars
+        except Exception as e:
+            logger.error("❌ Error loading state snapshot: %s", e)
+            return None
+
+class SignalStore:
+    """מאגר SQLite של איתותים שפורסמו - רק איתותים פתוחים נטענים בכל עדכון"""
+
+    OPEN_STATUSES = ('pending', 'active')
+
+    def __init__(self, path=SIGNALS_DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                asset_type TEXT NOT NULL,
+                published_at TEXT NOT NULL,
+                reference_price REAL NOT NULL,
+                entry REAL NOT NULL,
+                stop REAL NOT NULL,
+                target1 REAL NOT NULL,
+                target2 REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                outcome TEXT,
+                entered_at TEXT,
+                target1_hit_at TEXT,
+                closed_at TEXT,
+                exit_price REAL,
+                return_pct REAL,
+                last_bar_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_signals_open ON signals (status) WHERE status != 'closed';
+            CREATE INDEX IF NOT EXISTS idx_signals_closed_at ON signals (closed_at) WHERE closed_at IS NOT NULL;
+        """)
+        self.conn.commit()
+
+    def record_signal(self, symbol, asset_type, reference_price, entry, stop, target1, target2, published_at=None):
+        """שמירת איתות שפורסם עם הרמות שלו"""
+        published_at = published_at or datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO signals (symbol, asset_type, published_at, reference_price, entry, stop, target1, target2) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (symbol, asset_type, published_at, reference_price, entry, stop, target1, target2)
+            )
+        return cursor.lastrowid
+
+    def open_signals(self):
+        return [dict(row) for row in self.conn.execute(
+            "SELECT * FROM signals WHERE status != 'closed' ORDER BY id"
+        )]
+
+    def save_updates(self, signals):
+        """שמירת כל העדכונים של סבב מעקב בטרנזקציה אחת"""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE signals SET status = :status, outcome = :outcome, entered_at = :entered_at, "
+                "target1_hit_at = :target1_hit_at, closed_at = :closed_at, exit_price = :exit_price, "
+                "return_pct = :return_pct, last_bar_at = :last_bar_at WHERE id = :id",
+                signals
+            )
+
+    def closed_between(self, start, end):
+        return [dict(row) for row in self.conn.execute(
+            "SELECT * FROM signals WHERE closed_at >= ? AND closed_at < ? ORDER BY closed_at",
+            (start, end)
+        )]
+
+    def close(self):
+        self.conn.close()
+
+def stock_bars_closing(now=None):
+    """האם בשעה האחרונה נסגר בר שעה של מניות - ימי חול, 10:30-17:10 בשעון ניו יורק"""
+    now = now or datetime.now(timezone.utc)
+    local = now.astimezone(STOCK_EXCHANGE_TZ)
+    seconds = local.hour * 3600 + local.minute * 60 + local.second
+    return local.weekday() < 5 and STOCK_SESSION[0] + 3600 <= seconds <= STOCK_SESSION[1] + 3600 + 600
+
+def apply_bars_to_signal(signal, bars, now=None, interval=SIGNAL_TRACKING_INTERVAL):
+    """עדכון מצב איתות מברים שנסגרו - מחזיר True אם המצב השתנה.
+
+    בר שעדיין נבנה (התחלה + אורך הבר > עכשיו, ב-UTC) לא נספר - אחרת last_bar_at
+    מתקדם אליו ושאר הבר לא נבדק לעולם.
+    """
+    published_at = datetime.strptime(signal['published_at'], "%Y-%m-%d %H:%M:%S")
+    after = signal['last_bar_at'] or signal['published_at']
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    complete_before = (now - timedelta(seconds=TIMEFRAME_SECONDS[interval])).strftime("%Y-%m-%d %H:%M:%S")
+    changed = False
+
+    for bar in bars:
+        # ברים בפורמט יומי ('YYYY-MM-DD') או תוך-יומי
+        bar_time = bar['datetime'] if len(bar['datetime']) > 10 else bar['datetime'] + " 00:00:00"
+        if bar_time <= after:
+            continue
+        if bar_time > complete_before:
+            break
+        signal['last_bar_at'] = bar_time
+        changed = True
+
+        if signal['status'] == 'pending':
+            if bar['high'] >= signal['entry']:
+                signal['status'] = 'active'
+                signal['entered_at'] = bar_time
+            elif datetime.strptime(bar_time, "%Y-%m-%d %H:%M:%S") - published_at >= SIGNAL_ENTRY_TIMEOUT:
+                _close_signal(signal, 'no_entry', bar_time, None)
+                break
+            else:
+                continue
+
+        # בר שנוגע בסטופ וביעד יחד נספר כסטופ (הנחה שמרנית)
+        if bar['low'] <= signal['stop']:
+            _close_signal(signal, 'stop', bar_time, min(signal['stop'], bar['open']))
+            break
+        if bar['high'] >= signal['target1'] and not signal['target1_hit_at']:
+            signal['target1_hit_at'] = bar_time
+        if bar['high'] >= signal['target2']:
+            _close_signal(signal, 'target2', bar_time, max(signal['target2'], bar['open']))
+            break
+        if datetime.strptime(bar_time, "%Y-%m-%d %H:%M:%S") - published_at >= SIGNAL_MAX_DURATION:
+            _close_signal(signal, 'timeout', bar_time, bar['close'])
+            break
+
+    return changed
+
+def _close_signal(signal, outcome, closed_at, exit_price):
+    signal['status'] = 'closed'
+    signal['outcome'] = outcome
+    signal['closed_at'] = closed_at
+    signal['exit_price'] = exit_price
+    signal['return_pct'] = (exit_price / signal['entry'] - 1) * 100 if exit_price is not None else None
+
+class PaymentScreenshotStore:
+    """שמירת צילומי מסך בדיסק לפי hash של התוכן - הורדה בזרימה, ללא טעינה מלאה לזיכרון.
+
+    קובץ בתיקייה = צילום שנמצא בבדיקה או שאושר; צילום שנדחה נמחק, כדי שאפשר יהיה לשלוח אותו שוב.
+    """
+
+    def __init__(self, directory=PAYMENT_SCREENSHOTS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, digest, extension='.jpg'):
+        return os.path.join(self.directory, digest + extension)
+
+    def download(self, url):
+        """הורדה לקובץ זמני תוך חישוב sha256 - מחזיר (hash, נתיב זמני)"""
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f, requests.get(url, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=SCREENSHOT_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            return hasher.hexdigest(), tmp_path
+            
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+
+    def keep(self, tmp_path, digest, extension='.jpg'):
+        """העברת ההורדה לשם הקבוע לפי ה-hash"""
+        path = self.path_for(digest, extension)
+        os.replace(tmp_path, path)
+        return path
+
+    def discard(self, path):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+class PeakTradeBot:
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
         self.application = None
         self.scheduler = None
         self.google_client = None
         self.sheet = None
-        self.twelve_api = TwelveDataAPI(TWELVE_DATA_API_KEY)
+        self.sheets = None
+        self.price_stream = TwelveDataPriceStream(
+            TWELVE_DATA_API_KEY,
+            [s['symbol'] for s in PREMIUM_STOCKS] + [c['symbol'] for c in PREMIUM_CRYPTO]
+        )
+        self.price_stream_task = None
+        self.twelve_api = TwelveDataAPI(TWELVE_DATA_API_KEY, price_stream=self.price_stream)
+        self.trial_schedule = TrialLifecycleSchedule()
+        self.signal_store = SignalStore()
+        self.screenshot_store = PaymentScreenshotStore()
+        self.screenshot_queue = asyncio.Queue()
+        self.screenshot_worker_tasks = []
+        self.pending_reviews = {}
+        self.registering_users = set()
+        self.appending_registrations = set()
+        self.registration_append_failures = 0
+        self.trial_dispatcher_task = None
+        self.trial_events_in_flight = set()
+        self.sheet_headers = None
+        self.subscribers = SubscriberIndex()
+        self.state_snapshot = StateSnapshot()
+        self.pending_screenshots = {}
+        self.recent_symbols = collections.deque(maxlen=RECENT_SYMBOLS_LIMIT)
+        self.last_send_time = None
         
     def setup_google_sheets(self):
         """הגדרת חיבור ל-Google Sheets"""
@@ -158,7 +1673,7 @@ class PeakTradeBot:
             
             # פירוק JSON credentials
             creds_dict = json.loads(GOOGLE_CREDENTIALS)
-            logger.info(f"📋 Service account email: {creds_dict.get('client_email', 'N/A')}")
+            logger.info("📋 Service account email: %s", creds_dict.get('client_email', 'N/A'))
             
             scope = [
                 'https://spreadsheets.google.com/feeds',
@@ -169,44 +1684,87 @@ class PeakTradeBot:
             self.google_client = gspread.authorize(creds)
             
             # פתיחת הגיליון
-            self.sheet = self.google_client.open_by_key(SPREADSHEET_ID).sheet1
+            self.attach_sheet(self.google_client.open_by_key(SPREADSHEET_ID).sheet1)
             
-            # בדיקת גישה
-            test_data = self.sheet.get_all_records()
-            logger.info(f"✅ Google Sheets connected successfully! Found {len(test_data)} existing records")
+            # בדיקת גישה - שורת הכותרות בלבד, הרשומות נטענות לאינדקס המנויים
+            self.sheet_headers = self.sheet.row_values(1)
+            logger.info("✅ Google Sheets connected successfully! %s columns", len(self.sheet_headers))
             
             return True
             
         except json.JSONDecodeError as e:
-            logger.error(f"❌ Error parsing GOOGLE_CREDENTIALS JSON: {e}")
+            logger.error("❌ Error parsing GOOGLE_CREDENTIALS JSON: %s", e)
             return False
         except Exception as e:
-            logger.error(f"❌ Error setting up Google Sheets: {e}")
+            logger.error("❌ Error setting up Google Sheets: %s", e)
             return False
 
+    def attach_sheet(self, worksheet, **gateway_options):
+        """חיבור הגיליון - כל הגישה מהקוד האסינכרוני עוברת דרך SheetsGateway"""
+        self.sheet = worksheet
+        self.sheets = SheetsGateway(worksheet, **gateway_options)
+
     def check_user_exists(self, user_id):
-        """בדיקה אם משתמש כבר קיים ב-Google Sheets"""
-        try:
-            if not self.sheet:
-                logger.warning("⚠️ No Google Sheets connection")
-                return False
-            
-            logger.info(f"🔍 Checking if user {user_id} exists...")
-            records = self.sheet.get_all_records()
-            
-            for record in records:
-                if str(record.get('telegram_user_id')) == str(user_id):
-                    status = record.get('payment_status', '')
-                    logger.info(f"👤 User {user_id} found with status: {status}")
-                    if status in ['trial_active', 'paid_subscriber']:
-                        return True
-            
-            logger.info(f"✅ User {user_id} not found - new user")
+        """בדיקה אם למשתמש יש מנוי פעיל - לפי אינדקס המנויים בזיכרון"""
+        if not self.sheets:
+            logger.warning("⚠️ No Google Sheets connection")
             return False
-            
-        except Exception as e:
-            logger.error(f"❌ Error checking user existence: {e}")
+        
+        entry = self.subscribers.get(user_id)
+        if entry is None:
+            logger.debug("✅ User %s not found - new user", user_id)
             return False
+        
+        logger.debug("👤 User %s found with status: %s", user_id, entry[1])
+        return self.subscribers.is_active(user_id)
+
+    async def load_subscriber_index(self):
+        """סנכרון האינדקס מול עמודת הסטטוס בגיליון (קריאה אחת), או בנייה מחדש.
+
+        אם מספר השורות לא השתנה, סטטוסים שנערכו ידנית בגיליון (למשל אישור תשלום)
+        מתעדכנים באינדקס. רץ בהפעלה ומדי SUBSCRIBER_SYNC_MINUTES דקות.
+        מחזיר את הרשומות אם נקראו מהגיליון (כדי לא לקרוא אותן פעמיים), אחרת None.
+        """
+        if not self.sheets:
+            return None
+        
+        try:
+            if self.subscribers.row_count:
+                statuses = await self.sheets.col_values(8)
+                if len(statuses) == self.subscribers.row_count:
+                    changed = self.subscribers.apply_statuses(statuses)
+                    logger.info("✅ Subscriber index in sync: %s users, %s status changes from the sheet", len(self.subscribers), changed)
+                    return None
+                logger.info("🔄 Sheet has %s rows, index had %s - rebuilding subscriber index", len(statuses), self.subscribers.row_count)
+            
+            records = await self.sheets.get_all_records()
+            self.subscribers.rebuild(records)
+            logger.info("✅ Subscriber index built from %s records: %s users", len(records), len(self.subscribers))
+            return records
+        
+        except Exception as e:
+            logger.error("❌ Error loading subscriber index: %s", e)
+            return None
+
+    async def get_user_record(self, user_id):
+        """שליפת השורה האחרונה של משתמש מהגיליון - (מספר שורה, רשומה)"""
+        if self.sheet_headers is None:
+            self.sheet_headers = await self.sheets.row_values(1)
+
+        # השורה מהאינדקס חוסכת חיפוש - כל עוד היא עדיין שייכת למשתמש
+        entry = self.subscribers.get(user_id)
+        if entry is not None and entry[0]:
+            values = await self.sheets.row_values(entry[0])
+            if values and values[0] == str(user_id):
+                return entry[0], dict(zip(self.sheet_headers, values))
+
+        cells = await self.sheets.findall(str(user_id), in_column=1)
+        if not cells:
+            return None, None
+
+        row_index = cells[-1].row
+        values = await self.sheets.row_values(row_index)
+        return row_index, dict(zip(self.sheet_headers, values))
 
     def create_professional_chart_with_prices(self, symbol, data, current_price, entry_price, stop_loss, target1, target2):
         """יצירת גרף מקצועי עם מחירים ספציפיים מסומנים - טקסט באנגלית"""
@@ -255,18 +1813,31 @@ class PeakTradeBot:
             buffer.seek(0)
             plt.close()
             
-            logger.info(f"✅ Professional chart created for {symbol}")
+            logger.info("✅ Professional chart created for %s", symbol)
             return buffer
             
         except Exception as e:
-            logger.error(f"❌ Error creating chart: {e}")
+            logger.error("❌ Error creating chart: %s", e)
             return None
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """פקודת התחלה - לינק מיידי ללא אישור"""
         user = update.effective_user
-        logger.info(f"User {user.id} ({user.username}) started PeakTrade bot")
+        logger.info("User %s (%s) started PeakTrade bot", user.id, user.username)
+        
+        # עדכונים מטופלים במקביל - לחיצה כפולה על /start לא תיצור רישום כפול
+        if user.id in self.registering_users:
+            logger.info("⏳ Registration already in progress for user %s", user.id)
+            return
         
+        self.registering_users.add(user.id)
+        try:
+            await self.register_user(update, context, user)
+        finally:
+            self.registering_users.discard(user.id)
+
+    async def register_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+        """רישום משתמש חדש ושליחת לינק הזמנה"""
         # בדיקה אם משתמש כבר קיים
         if self.check_user_exists(user.id):
             await update.message.reply_text(
@@ -279,14 +1850,18 @@ class PeakTradeBot:
         )
         
         try:
-            # רישום המשתמש ב-Google Sheets
-            sheets_success = await self.log_user_registration(user)
+            now = self.clock.now()
+            trial_end = now + timedelta(days=7)
+            
+            # ההרשמה נשמרת לפני שליחת הלינק, והכתיבה לגיליון רצה ברקע - הטיפול בעדכון לא מחכה לגיליון
+            new_row = self.begin_registration(user)
+            context.application.create_task(self.append_registration(user.id, new_row), update=update)
             
             # יצירת לינק הזמנה
             invite_link = await context.bot.create_chat_invite_link(
                 chat_id=CHANNEL_ID,
                 member_limit=1,
-                expire_date=int((datetime.now() + timedelta(days=8)).timestamp()),
+                expire_date=int((now + timedelta(days=8)).timestamp()),
                 name=f"Trial_{user.id}_{user.username or 'user'}"
             )
             
@@ -294,7 +1869,7 @@ class PeakTradeBot:
 
 היי, זה מצוות הערוץ ״PeakTrade VIP״ 
 
-המנוי שלך מתחיל היום {datetime.now().strftime('%d.%m')} ויסתיים ב{(datetime.now() + timedelta(days=7)).strftime('%d.%m')}
+המנוי שלך מתחיל היום {now.strftime('%d.%m')} ויסתיים ב{trial_end.strftime('%d.%m')}
 
 חשוב להבהיר:
 🚫התוכן כאן אינו מהווה ייעוץ או המלצה פיננסית מכל סוג!
@@ -306,8 +1881,8 @@ class PeakTradeBot:
 {invite_link.invite_link}
 
 ⏰ תקופת הניסיון שלך: 7 ימים מלאים
-📅 מתחיל היום: {datetime.now().strftime("%d/%m/%Y")}
-📅 מסתיים: {(datetime.now() + timedelta(days=7)).strftime("%d/%m/%Y")}
+📅 מתחיל היום: {now.strftime("%d/%m/%Y")}
+📅 מסתיים: {trial_end.strftime("%d/%m/%Y")}
 
 🎯 מה מחכה לך בערוץ:
 • המלצות מניות חמות כל 30 דקות
@@ -324,47 +1899,133 @@ class PeakTradeBot:
                 disable_web_page_preview=True
             )
             
-            logger.info(f"✅ Direct registration successful for user {user.id} (Sheets: {sheets_success})")
+            logger.info("✅ Direct registration successful for user %s (Sheets write queued)", user.id)
             
         except Exception as e:
-            logger.error(f"❌ Error in direct registration: {e}")
+            logger.error("❌ Error in direct registration: %s", e)
             await processing_msg.edit_text(
                 "❌ אופס! משהו השתבש ברישום\n\nאנא נסה שוב או פנה לתמיכה."
             )
 
+    def begin_registration(self, user):
+        """שמירת ההרשמה ואירועי הניסיון בטבלה לפני הכתיבה לגיליון - מחזיר את שורת הגיליון.
+
+        כך משתמש שקיבל לינק לא נשאר בלי אירועי ניסיון אם הכתיבה נכשלה או שהבוט הופעל מחדש.
+        """
+        now = self.clock.now()
+        current_time = now.strftime("%Y-%m-%d %H:%M:%S")
+        trial_end_dt = now + timedelta(days=7)
+        trial_end = trial_end_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+        new_row = [
+            user.id,
+            user.username or "N/A",
+            "",  # email
+            current_time,  # registration_date
+            "confirmed",  # disclaimer_status
+            current_time,  # trial_start_date
+            trial_end,  # trial_end_date
+            "trial_active",  # payment_status
+            "",  # payment_screenshot
+            "",  # notes
+            current_time  # last_updated
+        ]
+
+        # סימון מיידי באינדקס - /start נוסף לא ירשום שוב בזמן שהכתיבה ממתינה
+        self.subscribers.add(user.id, None, "trial_active", trial_end)
+
+        # תזמון אירועי תקופת הניסיון לפי הזמן המדויק של המשתמש, יחד עם השורה הממתינה
+        self.trial_schedule.schedule_trial(user.id, trial_end_dt.replace(microsecond=0), now)
+        self.trial_schedule.add_pending_registration(user.id, new_row)
+        self.trial_schedule.save()
+        return new_row
+
     async def log_user_registration(self, user):
         """רישום משתמש ב-Google Sheets"""
         try:
-            if not self.sheet:
-                logger.error("❌ No Google Sheets connection for logging")
-                return False
-                
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            trial_end = (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
-            
-            logger.info(f"📝 Writing user {user.id} to Google Sheets...")
-            
-            new_row = [
-                user.id,
-                user.username or "N/A",
-                "",  # email
-                current_time,  # registration_date
-                "confirmed",  # disclaimer_status
-                current_time,  # trial_start_date
-                trial_end,  # trial_end_date
-                "trial_active",  # payment_status
-                "",  # payment_screenshot
-                "",  # notes
-                current_time  # last_updated
-            ]
-            
-            self.sheet.append_row(new_row)
-            logger.info(f"✅ User {user.id} successfully written to Google Sheets")
-            return True
-            
+            new_row = self.begin_registration(user)
         except Exception as e:
-            logger.error(f"❌ Error logging user registration: {e}")
+            logger.error("❌ Error saving user registration: %s", e)
             return False
+        return await self.append_registration(user.id, new_row)
+
+    async def append_registration(self, user_id, new_row, attempts=REGISTRATION_APPEND_ATTEMPTS, check_existing=False):
+        """כתיבת שורת הרשמה ממתינה לגיליון, עם ניסיונות חוזרים.
+
+        לפני ניסיון חוזר בודקים אם השורה כבר נכתבה (timeout אחרי כתיבה שהצליחה).
+        הרשמה שלא נכתבה נשארת בטבלה ומנוסה שוב ב-retry_pending_registrations.
+        """
+        if not self.sheets:
+            logger.error("❌ No Google Sheets connection for logging")
+            return False
+        if user_id in self.appending_registrations:
+            return False
+
+        self.appending_registrations.add(user_id)
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    await self.clock.sleep(REGISTRATION_RETRY_DELAY * 2 ** (attempt - 1))
+                try:
+                    row_index = None
+                    if attempt or check_existing:
+                        row_index = await self.find_registration_row(user_id, new_row[3])
+                    if row_index is None:
+                        logger.debug("📝 Writing user %s to Google Sheets...", user_id)
+                        row_index = appended_row_index(await self.sheets.append_row(new_row))
+                    break
+                except Exception as e:
+                    self.registration_append_failures += 1
+                    failures = self.trial_schedule.registration_failed(user_id)
+                    self.trial_schedule.save()
+                    logger.error(
+                        "❌ Error writing user %s to Google Sheets (failure %d): %s", user_id, failures, e,
+                        extra={'event': 'registration_append_failed', 'user_id': user_id,
+                               'failures': failures, 'total_failures': self.registration_append_failures}
+                    )
+            else:
+                logger.warning(
+                    "⚠️ Registration of user %s is still pending - retrying in the background", user_id,
+                    extra={'event': 'registration_pending', 'user_id': user_id}
+                )
+                return False
+        finally:
+            self.appending_registrations.discard(user_id)
+
+        logger.info("✅ User %s successfully written to Google Sheets", user_id)
+        if row_index:
+            self.subscribers.add(user_id, row_index, new_row[7], new_row[6])
+        self.trial_schedule.complete_registration(user_id)
+        self.trial_schedule.save()
+        return True
+
+    async def find_registration_row(self, user_id, registered_at):
+        """מספר השורה של ההרשמה בגיליון אם כבר נכתבה, אחרת None"""
+        cells = await self.sheets.findall(str(user_id), in_column=1)
+        if not cells:
+            return None
+        # הרשמה אחרונה של המשתמש היא השורה האחרונה שלו
+        values = await self.sheets.row_values(cells[-1].row)
+        if len(values) > 3 and values[3] == registered_at:
+            return cells[-1].row
+        return None
+
+    async def retry_pending_registrations(self):
+        """ניסיון חוזר להרשמות שעוד לא נכתבו לגיליון - בהפעלה ומדי REGISTRATION_RETRY_MINUTES דקות"""
+        pending = self.trial_schedule.pending_registrations()
+        if not pending or not self.sheets:
+            return
+        written = 0
+        for user_id, new_row, _ in pending:
+            if await self.append_registration(user_id, new_row, attempts=1, check_existing=True):
+                written += 1
+        logger.info("🔄 Pending registrations: %s written to Google Sheets, %s still pending", written, len(pending) - written)
+
+    def restore_pending_registrations(self):
+        """הרשמות ממתינות מההפעלה הקודמת חוזרות לאינדקס המנויים - /start לא ירשום אותן שוב"""
+        for user_id, new_row, _ in self.trial_schedule.pending_registrations():
+            if self.subscribers.get(user_id) is None:
+                self.subscribers.add(user_id, None, new_row[7], new_row[6])
 
     async def send_trial_expiry_reminder(self, user_id):
         """שליחת תזכורת תשלום יום לפני סיום תקופת הניסיון"""
@@ -395,10 +2056,12 @@ class PeakTradeBot:
                 reply_markup=reply_markup
             )
             
-            logger.info(f"✅ Payment reminder sent to user {user_id}")
+            logger.debug("✅ Payment reminder sent to user %s", user_id)
+            return True
             
         except Exception as e:
-            logger.error(f"❌ Error sending payment reminder to user {user_id}: {e}")
+            logger.error("❌ Error sending payment reminder to user %s: %s", user_id, e)
+            return False
 
     async def send_final_payment_message(self, user_id):
         """שליחת הודעת תשלום סופית"""
@@ -420,10 +2083,12 @@ class PeakTradeBot:
                 text=final_message
             )
             
-            logger.info(f"✅ Final payment message sent to user {user_id}")
+            logger.debug("✅ Final payment message sent to user %s", user_id)
+            return True
             
         except Exception as e:
-            logger.error(f"❌ Error sending final payment message to user {user_id}: {e}")
+            logger.error("❌ Error sending final payment message to user %s: %s", user_id, e)
+            return False
 
     async def remove_user_after_trial(self, user_id, row_index=None):
         """הסרת משתמש מהערוץ לאחר סיום תקופת ניסיון ללא תשלום"""
@@ -451,63 +2116,161 @@ class PeakTradeBot:
             except:
                 pass
             
-            if row_index and self.sheet:
-                current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if row_index and self.sheets:
+                current_time = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
                 try:
-                    self.sheet.update_cell(row_index, 8, "expired_no_payment")
-                    self.sheet.update_cell(row_index, 11, current_time)
-                    logger.info(f"📝 Updated Google Sheets for user {user_id} removal")
+                    await self.sheets.update_row(row_index, {8: "expired_no_payment", 11: current_time})
+                    self.subscribers.set_status(user_id, "expired_no_payment")
+                    logger.debug("📝 Updated Google Sheets for user %s removal", user_id)
                 except Exception as update_error:
-                    logger.error(f"Error updating expiry status: {update_error}")
+                    logger.error("Error updating expiry status: %s", update_error)
             
-            logger.info(f"✅ User {user_id} removed after trial expiry")
+            logger.debug("✅ User %s removed after trial expiry", user_id)
+            return True
             
         except Exception as e:
-            logger.error(f"❌ Error removing user {user_id}: {e}")
+            logger.error("❌ Error removing user %s: %s", user_id, e)
+            return False
 
     async def check_trial_expiry(self):
-        """בדיקה יומית של סיום תקופת ניסיון"""
+        """טיפול באירועי תקופת ניסיון שהגיע זמנם"""
+        due_events = self.trial_schedule.pop_due(self.clock.now())
+        if not due_events:
+            return
+
+        started = time.perf_counter()
+        outcomes = collections.Counter()
+        # תקופות הניסיון של הריצה - כבר לא בטבלה, ולא יתוזמנו שוב בזמן שהן בטיפול
+        self.trial_events_in_flight = {
+            (event['user_id'], event['trial_end'].isoformat(" ", "seconds")) for event in due_events
+        }
         try:
-            logger.info("🔍 Starting trial expiry check...")
-            
-            if not self.sheet:
+            for event in due_events:
+                outcomes[await self.process_trial_event(event)] += 1
+
+        except Exception as e:
+            logger.error("❌ Error checking trial expiry: %s", e)
+        finally:
+            self.trial_events_in_flight = set()
+            try:
+                self.trial_schedule.save()
+            except OSError as e:
+                logger.error("❌ Error saving trial schedule: %s", e)
+
+            # שורת סיכום אחת לכל ריצה במקום שורה לכל משתמש
+            duration_ms = (time.perf_counter() - started) * 1000
+            logger.info(
+                "⏰ Trial events: %d due, %s in %.0fms", len(due_events), dict(outcomes), duration_ms,
+                extra={'event': 'trial_events_run', 'due': len(due_events), 'outcomes': dict(outcomes),
+                       'duration_ms': round(duration_ms, 1)}
+            )
+
+    async def process_trial_event(self, event):
+        """ביצוע אירוע בודד - תזכורת, הודעה סופית או הסרה. מחזיר את התוצאה לסיכום הריצה"""
+        user_id = event['user_id']
+        try:
+            if not self.sheets:
                 logger.error("❌ No Google Sheets connection for trial check")
-                return
-            
-            records = self.sheet.get_all_records()
-            current_time = datetime.now()
-            
-            logger.info(f"📊 Checking {len(records)} records for trial expiry")
-            
-            for i, record in enumerate(records):
-                if record.get('payment_status') == 'trial_active':
-                    trial_end_str = record.get('trial_end_date')
-                    user_id = record.get('telegram_user_id')
-                    
-                    if trial_end_str and user_id:
-                        try:
-                            trial_end = datetime.strptime(trial_end_str, "%Y-%m-%d %H:%M:%S")
-                            days_diff = (trial_end - current_time).days
-                            
-                            logger.info(f"👤 User {user_id}: trial ends in {days_diff} days")
-                            
-                            # יום לפני סיום הניסיון - הודעה ראשונה
-                            if days_diff == 1:
-                                await self.send_trial_expiry_reminder(user_id)
-                            # יום אחרי סיום הניסיון - הודעה שנייה
-                            elif current_time > trial_end and (current_time - trial_end).days == 1:
-                                await self.send_final_payment_message(user_id)
-                            # יומיים אחרי סיום הניסיון - הסרה
-                            elif current_time > trial_end and (current_time - trial_end).days >= 2:
-                                await self.remove_user_after_trial(user_id, i + 2)
-                                
-                        except ValueError as ve:
-                            logger.error(f"Invalid date format for user {user_id}: {trial_end_str} - {ve}")
-            
-            logger.info("✅ Trial expiry check completed")
-            
+                self.trial_schedule.reschedule(event, self.clock.now() + timedelta(hours=1))
+                return 'rescheduled'
+
+            if self.trial_schedule.is_registration_pending(user_id):
+                # ההרשמה עוד לא נכתבה לגיליון (השורה הקיימת, אם יש, ישנה) - האירוע מחכה לה בלי לספור ניסיון
+                self.trial_schedule.reschedule(event, self.clock.now() + TRIAL_RETRY_DELAY)
+                return 'rescheduled'
+
+            row_index, record = await self.get_user_record(user_id)
+            if record is None or record.get('payment_status') != 'trial_active':
+                return 'skipped'
+
+            # תאריך הסיום בגיליון השתנה (הארכה ידנית או הרשמה מחדש) - האירוע הישן לא רלוונטי,
+            # ותקופת הניסיון הנוכחית מתוזמנת אם עוד אין לה אירועים
+            if record.get('trial_end_date') != event['trial_end'].strftime("%Y-%m-%d %H:%M:%S"):
+                try:
+                    trial_end = datetime.strptime(record.get('trial_end_date', ''), "%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    logger.error("Invalid trial_end_date for user %s: %s", user_id, record.get('trial_end_date'))
+                    return 'skipped'
+                if self.trial_schedule.ensure_trial(user_id, trial_end, self.clock.now(), self.trial_events_in_flight):
+                    return 'rescheduled'
+                return 'skipped'
+
+            logger.debug("👤 User %s: trial event '%s' due at %s", user_id, event['kind'], event['due_at'])
+
+            if event['kind'] == TrialLifecycleSchedule.REMINDER:
+                sent = await self.send_trial_expiry_reminder(user_id)
+            elif event['kind'] == TrialLifecycleSchedule.FINAL:
+                sent = await self.send_final_payment_message(user_id)
+            else:
+                sent = await self.remove_user_after_trial(user_id, row_index)
+            return event['kind'] if sent else self.retry_trial_event(event)
+
         except Exception as e:
-            logger.error(f"❌ Error checking trial expiry: {e}")
+            logger.error("❌ Error processing trial event for user %s: %s", user_id, e)
+            return self.retry_trial_event(event)
+
+    def retry_trial_event(self, event):
+        """החזרת אירוע שנכשל לתור עם backoff - הסרה מנוסה שוב תמיד, הודעות עד TRIAL_MESSAGE_MAX_ATTEMPTS"""
+        attempts = event.get('attempts', 0) + 1
+        if event['kind'] != TrialLifecycleSchedule.REMOVAL and attempts >= TRIAL_MESSAGE_MAX_ATTEMPTS:
+            logger.warning("⚠️ Giving up on trial %s for user %s after %d attempts", event['kind'], event['user_id'], attempts)
+            return 'abandoned'
+        delay = min(TRIAL_RETRY_DELAY * 2 ** (attempts - 1), TRIAL_RETRY_MAX_DELAY)
+        self.trial_schedule.reschedule(event, self.clock.now() + delay, attempts)
+        return 'retry'
+
+    async def load_trial_schedule(self, records=None):
+        """טעינת אינדקס אירועי הניסיון, או בנייה מהגיליון אם אין קובץ שמור"""
+        if self.trial_schedule.load():
+            logger.info("✅ Trial schedule loaded: %s pending events", len(self.trial_schedule))
+            # הרשומות כבר נקראו (אינדקס המנויים נבנה מחדש) - השוואה בלי קריאה נוספת
+            if records is not None:
+                await self.reconcile_trial_schedule(records)
+            return
+
+        if not self.sheets:
+            logger.error("❌ No Google Sheets connection for building trial schedule")
+            return
+
+        try:
+            if records is None:
+                records = await self.sheets.get_all_records()
+            self.trial_schedule.rebuild_from_records(records, self.clock.now())
+            self.trial_schedule.save()
+            logger.info("✅ Trial schedule built from %s records: %s pending events", len(records), len(self.trial_schedule))
+        except Exception as e:
+            logger.error("❌ Error building trial schedule: %s", e)
+
+    async def reconcile_trial_schedule(self, records=None):
+        """השוואת התור לגיליון - תקופות ניסיון שהוארכו או הוחזרו ל-trial_active מקבלות אירועים"""
+        if not self.sheets:
+            return
+        try:
+            if records is None:
+                records = await self.sheets.get_all_records()
+                self.subscribers.rebuild(records)
+            added = self.trial_schedule.reconcile_with_records(records, self.clock.now(), self.trial_events_in_flight)
+            self.trial_schedule.save()
+            logger.info("🔄 Trial schedule reconciled with %s records: %s trials added", len(records), added)
+        except Exception as e:
+            logger.error("❌ Error reconciling trial schedule: %s", e)
+
+    async def run_trial_dispatcher(self):
+        """לולאה שמתעוררת כשהאירוע הבא בתור מגיע"""
+        while True:
+            await self.check_trial_expiry()
+
+            self.trial_schedule.wakeup.clear()
+            next_due = self.trial_schedule.next_due()
+            # התעוררות לפחות פעם בשעה - הגנה מפני שינויי שעון
+            timeout = 3600
+            if next_due is not None:
+                timeout = min(timeout, max(0, (next_due - self.clock.now()).total_seconds()))
+
+            try:
+                await asyncio.wait_for(self.trial_schedule.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
 
     async def handle_payment_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """טיפול בבחירת תשלום"""
@@ -564,6 +2327,149 @@ class PeakTradeBot:
                 text="❌ התשלום בוטל.\n\nתקבל תזכורת נוספת מחר."
             )
 
+    async def handle_payment_screenshot(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """קליטת צילום מסך של תשלום - הכנסה לתור ותשובה מיידית"""
+        user = update.effective_user
+        message = update.message
+        
+        if message.photo:
+            attachment = message.photo[-1]  # הרזולוציה הגבוהה ביותר
+            extension = '.jpg'
+        else:
+            attachment = message.document
+            extension = os.path.splitext(attachment.file_name or '')[1].lower() or '.jpg'
+        
+        job = {
+            'user_id': user.id,
+            'username': user.username,
+            'file_id': attachment.file_id,
+            'extension': extension,
+            'received_at': self.clock.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.pending_screenshots[job['file_id']] = job
+        await self.screenshot_queue.put(job)
+        
+        logger.info("📸 Payment screenshot queued for user %s (queue size: %s)", user.id, self.screenshot_queue.qsize())
+        
+        await message.reply_text(
+            "📸 קיבלנו את צילום המסך!\n\nהתשלום בבדיקה ונעדכן אותך ברגע שיאושר 🙏"
+        )
+
+    async def run_screenshot_worker(self):
+        """עיבוד צילומי מסך מהתור ברקע"""
+        while True:
+            job = await self.screenshot_queue.get()
+            try:
+                await self.process_payment_screenshot(job)
+            except Exception as e:
+                logger.error("❌ Error processing screenshot for user %s: %s", job['user_id'], e)
+            finally:
+                self.screenshot_queue.task_done()
+            # עבודה שנקטעה בכיבוי נשארת בתמונת המצב ומעובדת שוב בהפעלה הבאה
+            self.pending_screenshots.pop(job['file_id'], None)
+
+    async def process_payment_screenshot(self, job):
+        """הורדה, זיהוי כפילויות, קישור לרשומת המנוי ושליחה לבדיקת מנהל"""
+        user_id = job['user_id']
+        telegram_file = await self.application.bot.get_file(job['file_id'])
+        digest, tmp_path = await asyncio.to_thread(self.screenshot_store.download, telegram_file.file_path)
+        review_id = digest[:REVIEW_ID_LENGTH]
+        
+        # בדיקה ותפיסה באותו צעד של הלולאה - שני workers עם אותו צילום לא יעברו שניהם
+        in_review = review_id in self.pending_reviews
+        path = self.screenshot_store.path_for(digest, job['extension'])
+        if in_review or os.path.exists(path):
+            self.screenshot_store.discard(tmp_path)
+            logger.warning("⚠️ Duplicate payment screenshot %s from user %s", review_id[:12], user_id)
+            await self.application.bot.send_message(
+                chat_id=user_id,
+                text="ℹ️ צילום המסך הזה כבר התקבל אצלנו ונמצא בבדיקה." if in_review
+                else "ℹ️ צילום המסך הזה כבר התקבל ואושר בעבר."
+            )
+            return
+        
+        review = self.pending_reviews[review_id] = {
+            'user_id': user_id,
+            'digest': digest,
+            'path': path,
+            'row_index': None,
+            'username': job['username'],
+        }
+        self.screenshot_store.keep(tmp_path, digest, job['extension'])
+        
+        if self.sheets:
+            row_index, _ = await self.get_user_record(user_id)
+            if row_index:
+                review['row_index'] = row_index
+                await self.sheets.update_row(row_index, {9: os.path.basename(path), 11: job['received_at']})
+                logger.info("📝 Screenshot linked to user %s in Google Sheets", user_id)
+        
+        if not ADMIN_CHAT_ID:
+            logger.warning("⚠️ ADMIN_CHAT_ID not set - screenshot %s from user %s awaits manual review", review_id[:12], user_id)
+            return
+        
+        keyboard = [[
+            InlineKeyboardButton("✅ אשר תשלום", callback_data=f"approve_{user_id}_{review_id}"),
+            InlineKeyboardButton("❌ דחה", callback_data=f"reject_{user_id}_{review_id}")
+        ]]
+        
+        with open(path, 'rb') as photo:
+            await self.application.bot.send_photo(
+                chat_id=ADMIN_CHAT_ID,
+                photo=photo,
+                caption=f"💳 צילום תשלום לבדיקה\n\n👤 @{job['username'] or 'N/A'} ({user_id})\n🕐 {job['received_at']}",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        
+        logger.info("✅ Screenshot from user %s queued for admin review", user_id)
+
+    async def handle_review_decision(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """אישור או דחיית תשלום על ידי המנהל"""
+        query = update.callback_query
+        
+        if not ADMIN_CHAT_ID or str(query.message.chat_id) != str(ADMIN_CHAT_ID):
+            await query.answer("⛔ אין הרשאה", show_alert=True)
+            return
+        
+        await query.answer()
+        # approve_<user>_<review> (כפתורים ישנים: approve_<user>)
+        action, user_id, review_id = (query.data.split('_', 2) + [None])[:3]
+        review = self.pending_reviews.pop(review_id, {}) if review_id else {}
+        
+        try:
+            if action == 'approve':
+                row_index = review.get('row_index')
+                if not row_index and self.sheets:
+                    row_index, _ = await self.get_user_record(user_id)
+                
+                if not row_index:
+                    await query.edit_message_caption(caption=f"⚠️ משתמש {user_id} לא נמצא ב-Google Sheets")
+                    return
+                
+                current_time = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
+                await self.sheets.update_row(row_index, {8: "paid_subscriber", 11: current_time})
+                self.subscribers.set_status(user_id, "paid_subscriber")
+                
+                await self.application.bot.send_message(
+                    chat_id=int(user_id),
+                    text="✅ התשלום אושר!\n\nברוך הבא כמנוי PeakTrade VIP 💎\nבהצלחה במסחר! 💪"
+                )
+                await query.edit_message_caption(caption=f"✅ תשלום אושר - משתמש {user_id}")
+                logger.info("✅ Payment approved for user %s", user_id)
+            
+            else:
+                # צילום שנדחה נמחק - המשתמש יכול לשלוח אותו שוב
+                self.screenshot_store.discard(review.get('path'))
+                await self.application.bot.send_message(
+                    chat_id=int(user_id),
+                    text="❌ לא הצלחנו לאמת את התשלום.\n\nאנא שלח צילום מסך ברור של אישור התשלום או פנה לתמיכה."
+                )
+                await query.edit_message_caption(caption=f"❌ תשלום נדחה - משתמש {user_id}")
+                logger.info("❌ Payment rejected for user %s", user_id)
+                
+        except Exception as e:
+            logger.error("❌ Error handling review decision for user %s: %s", user_id, e)
+
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """פקודת עזרה"""
         help_text = f"""🆘 PeakTrade VIP Bot - מדריך מהיר
@@ -595,134 +2501,53 @@ class PeakTradeBot:
         self.application.add_handler(CommandHandler('start', self.start_command))
         self.application.add_handler(CommandHandler('help', self.help_command))
         self.application.add_handler(CommandHandler('cancel', self.cancel_command))
+        self.application.add_handler(CallbackQueryHandler(self.handle_review_decision, pattern=r'^(approve|reject)_'))
         self.application.add_handler(CallbackQueryHandler(self.handle_payment_choice))
+        self.application.add_handler(MessageHandler(
+            filters.ChatType.PRIVATE & (filters.PHOTO | filters.Document.IMAGE),
+            self.handle_payment_screenshot
+        ))
         
         logger.info("✅ All handlers configured")
 
+    def fresh_candidates(self, pool):
+        """סימבולים שלא פורסמו לאחרונה - או כל הרשימה אם כולם פורסמו"""
+        return [item for item in pool if item['symbol'] not in self.recent_symbols] or pool
+
     async def send_guaranteed_stock_content(self):
         """שליחת תוכן מניה מקצועי עם Twelve Data"""
         try:
             logger.info("📈 Preparing stock content with Twelve Data...")
             
-            # מגוון עצום של מניות מכל הסקטורים
-            premium_stocks = [
-                # טכנולוגיה גדולה
-                {'symbol': 'AAPL', 'type': 'AAPL', 'sector': 'טכנולוגיה'},
-                {'symbol': 'MSFT', 'type': 'MSFT', 'sector': 'טכנולוגיה'},
-                {'symbol': 'GOOGL', 'type': 'GOOGL', 'sector': 'טכנולוגיה'},
-                {'symbol': 'AMZN', 'type': 'AMZN', 'sector': 'מסחר אלקטרוני'},
-                {'symbol': 'META', 'type': 'META', 'sector': 'רשתות חברתיות'},
-                
-                # AI ושבבים
-                {'symbol': 'NVDA', 'type': 'NVDA', 'sector': 'AI/שבבים'},
-                {'symbol': 'AMD', 'type': 'AMD', 'sector': 'שבבים'},
-                {'symbol': 'INTC', 'type': 'INTC', 'sector': 'שבבים'},
-                {'symbol': 'TSM', 'type': 'TSM', 'sector': 'שבבים'},
-                {'symbol': 'AVGO', 'type': 'AVGO', 'sector': 'שבבים'},
-                
-                # רכב חשמלי ואנרגיה
-                {'symbol': 'TSLA', 'type': 'TSLA', 'sector': 'רכב חשמלי'},
-                {'symbol': 'RIVN', 'type': 'RIVN', 'sector': 'רכב חשמלי'},
-                {'symbol': 'LCID', 'type': 'LCID', 'sector': 'רכב חשמלי'},
-                {'symbol': 'F', 'type': 'F', 'sector': 'רכב'},
-                {'symbol': 'GM', 'type': 'GM', 'sector': 'רכב'},
-                
-                # בנקים ופיננסים
-                {'symbol': 'JPM', 'type': 'JPM', 'sector': 'בנקאות'},
-                {'symbol': 'BAC', 'type': 'BAC', 'sector': 'בנקאות'},
-                {'symbol': 'WFC', 'type': 'WFC', 'sector': 'בנקאות'},
-                {'symbol': 'GS', 'type': 'GS', 'sector': 'השקעות'},
-                {'symbol': 'MS', 'type': 'MS', 'sector': 'השקעות'},
-                
-                # בריאות ותרופות
-                {'symbol': 'JNJ', 'type': 'JNJ', 'sector': 'תרופות'},
-                {'symbol': 'PFE', 'type': 'PFE', 'sector': 'תרופות'},
-                {'symbol': 'MRNA', 'type': 'MRNA', 'sector': 'ביוטכנולוגיה'},
-                {'symbol': 'ABBV', 'type': 'ABBV', 'sector': 'תרופות'},
-                {'symbol': 'UNH', 'type': 'UNH', 'sector': 'ביטוח בריאות'},
-                
-                # תקשורת ומדיה
-                {'symbol': 'NFLX', 'type': 'NFLX', 'sector': 'סטרימינג'},
-                {'symbol': 'DIS', 'type': 'DIS', 'sector': 'בידור'},
-                {'symbol': 'CMCSA', 'type': 'CMCSA', 'sector': 'תקשורת'},
-                {'symbol': 'T', 'type': 'T', 'sector': 'טלקום'},
-                {'symbol': 'VZ', 'type': 'VZ', 'sector': 'טלקום'},
-                
-                # קמעונאות וצריכה
-                {'symbol': 'WMT', 'type': 'WMT', 'sector': 'קמעונאות'},
-                {'symbol': 'TGT', 'type': 'TGT', 'sector': 'קמעונאות'},
-                {'symbol': 'HD', 'type': 'HD', 'sector': 'שיפוצים'},
-                {'symbol': 'LOW', 'type': 'LOW', 'sector': 'שיפוצים'},
-                {'symbol': 'COST', 'type': 'COST', 'sector': 'קמעונאות'},
-                
-                # אנרגיה ונפט
-                {'symbol': 'XOM', 'type': 'XOM', 'sector': 'נפט'},
-                {'symbol': 'CVX', 'type': 'CVX', 'sector': 'נפט'},
-                {'symbol': 'COP', 'type': 'COP', 'sector': 'נפט'},
-                {'symbol': 'SLB', 'type': 'SLB', 'sector': 'שירותי נפט'},
-                
-                # תעופה ותיירות
-                {'symbol': 'BA', 'type': 'BA', 'sector': 'תעופה'},
-                {'symbol': 'AAL', 'type': 'AAL', 'sector': 'חברות תעופה'},
-                {'symbol': 'DAL', 'type': 'DAL', 'sector': 'חברות תעופה'},
-                {'symbol': 'UAL', 'type': 'UAL', 'sector': 'חברות תעופה'},
-                
-                # מזון ומשקאות
-                {'symbol': 'KO', 'type': 'KO', 'sector': 'משקאות'},
-                {'symbol': 'PEP', 'type': 'PEP', 'sector': 'משקאות'},
-                {'symbol': 'MCD', 'type': 'MCD', 'sector': 'מזון מהיר'},
-                {'symbol': 'SBUX', 'type': 'SBUX', 'sector': 'קפה'},
-                
-                # נדל"ן ובנייה
-                {'symbol': 'AMT', 'type': 'AMT', 'sector': 'REIT'},
-                {'symbol': 'PLD', 'type': 'PLD', 'sector': 'נדלן תעשייתי'},
-                {'symbol': 'CCI', 'type': 'CCI', 'sector': 'תשתיות'},
-                
-                # מניות מתפרצות וגדילה
-                {'symbol': 'ROKU', 'type': 'ROKU', 'sector': 'סטרימינג'},
-                {'symbol': 'PLTR', 'type': 'PLTR', 'sector': 'ביג דאטה'},
-                {'symbol': 'SNOW', 'type': 'SNOW', 'sector': 'ענן'},
-                {'symbol': 'CRWD', 'type': 'CRWD', 'sector': 'סייבר'},
-                {'symbol': 'ZM', 'type': 'ZM', 'sector': 'וידאו'},
-                {'symbol': 'SHOP', 'type': 'SHOP', 'sector': 'אי-קומרס'},
-                {'symbol': 'SQ', 'type': 'SQ', 'sector': 'פינטק'},
-                {'symbol': 'PYPL', 'type': 'PYPL', 'sector': 'תשלומים'},
-            ]
-            
-            # קריפטו
-            premium_crypto = [
-                {'symbol': 'BTC/USD', 'name': 'Bitcoin', 'type': 'Bitcoin'},
-                {'symbol': 'ETH/USD', 'name': 'Ethereum', 'type': 'Ethereum'},
-                {'symbol': 'BNB/USD', 'name': 'Binance', 'type': 'Binance'},
-                {'symbol': 'XRP/USD', 'name': 'Ripple', 'type': 'Ripple'},
-                {'symbol': 'ADA/USD', 'name': 'Cardano', 'type': 'Cardano'},
-                {'symbol': 'SOL/USD', 'name': 'Solana', 'type': 'Solana'},
-                {'symbol': 'DOGE/USD', 'name': 'Dogecoin', 'type': 'Dogecoin'},
-                {'symbol': 'DOT/USD', 'name': 'Polkadot', 'type': 'Polkadot'},
-                {'symbol': 'AVAX/USD', 'name': 'Avalanche', 'type': 'Avalanche'},
-                {'symbol': 'SHIB/USD', 'name': 'Shiba', 'type': 'Shiba'},
-            ]
-            
             # בחירה אקראית בין מניה לקריפטו (80% מניות, 20% קריפטו)
             content_type = random.choices(['stock', 'crypto'], weights=[80, 20])[0]
             
             if content_type == 'stock':
-                selected = random.choice(premium_stocks)
+                selected = random.choice(self.fresh_candidates(PREMIUM_STOCKS))
                 symbol = selected['symbol']
+                self.recent_symbols.append(symbol)
                 stock_type = selected['type']
                 sector = selected['sector']
                 
-                data = self.twelve_api.get_stock_data(symbol)
+                # בר שעה אחד נמשך - 4h, יומי ושבועי מחושבים ממנו. הקריאה ל-API רצה ב-thread
+                frames = await asyncio.to_thread(self.twelve_api.get_timeframes, symbol, STOCK_CONTENT_TIMEFRAMES)
+                data = frames.get('1day')
+                if data is None or data.empty:
+                    data = await asyncio.to_thread(self.twelve_api.get_stock_data, symbol)
+                trends = format_timeframe_trends(frames)
+                trend_line = f"\n• מגמה לפי טווחי זמן: {trends}" if trends else ""
                 
                 if data is None or data.empty:
-                    logger.warning(f"No Twelve Data for {symbol}")
+                    logger.warning("No Twelve Data for %s", symbol)
                     await self.send_text_analysis(symbol, stock_type)
                     return
                 
                 await asyncio.sleep(1)
                 
-                current_price = data['Close'][-1]
-                change = data['Close'][-1] - data['Close'][-2] if len(data) > 1 else 0
+                # מחיר חי מהזרם אם הוא טרי, אחרת סגירה אחרונה
+                live_price = self.twelve_api.get_live_price(symbol)
+                current_price = live_price if live_price is not None else data['Close'][-1]
+                change = current_price - data['Close'][-2] if len(data) > 1 else 0
                 change_percent = (change / data['Close'][-2] * 100) if len(data) > 1 and data['Close'][-2] != 0 else 0
                 volume = data['Volume'][-1] if len(data) > 0 else 0
                 
@@ -730,10 +2555,10 @@ class PeakTradeBot:
                 low_30d = data['Low'].min()
                 avg_volume = data['Volume'].mean()
                 
-                entry_price = current_price * 1.02
-                stop_loss = current_price * 0.95
-                profit_target_1 = current_price * 1.08
-                profit_target_2 = current_price * 1.15
+                entry_price = current_price * STOCK_SIGNAL_RULE['entry']
+                stop_loss = current_price * STOCK_SIGNAL_RULE['stop']
+                profit_target_1 = current_price * STOCK_SIGNAL_RULE['target1']
+                profit_target_2 = current_price * STOCK_SIGNAL_RULE['target2']
                 
                 risk = entry_price - stop_loss
                 reward = profit_target_1 - entry_price
@@ -749,7 +2574,7 @@ class PeakTradeBot:
 • טווח מחירים: ${low_30d:.2f} - ${high_30d:.2f}
 • נפח מסחר ממוצע: {avg_volume:,.0f}
 • נפח היום: {volume:,.0f}
-• מומנטום: {'חיובי 📈' if change_percent > 0 else 'שלילי 📉'} ({change_percent:+.2f}%)
+• מומנטום: {'חיובי 📈' if change_percent > 0 else 'שלילי 📉'} ({change_percent:+.2f}%){trend_line}
 
 🎯 אסטרטגיית המסחר שלנו:
 🟢 נקודת כניסה: ${entry_price:.2f}
@@ -770,31 +2595,54 @@ class PeakTradeBot:
                         photo=chart_buffer,
                         caption=caption
                     )
-                    logger.info(f"✅ Twelve Data stock content sent for {symbol}")
+                    logger.info("✅ Twelve Data stock content sent for %s", symbol)
                 else:
                     await self.application.bot.send_message(
                         chat_id=CHANNEL_ID,
                         text=caption
                     )
-                    logger.info(f"✅ Twelve Data stock content (text) sent for {symbol}")
+                    logger.info("✅ Twelve Data stock content (text) sent for %s", symbol)
+                
+                self.record_published_signal(symbol, 'stock', current_price, entry_price, stop_loss, profit_target_1, profit_target_2)
             
             else:  # קריפטו
-                selected = random.choice(premium_crypto)
+                selected = random.choice(self.fresh_candidates(PREMIUM_CRYPTO))
                 symbol = selected['symbol']
+                self.recent_symbols.append(symbol)
                 crypto_name = selected['name']
                 crypto_type = selected['type']
                 
                 await self.send_crypto_analysis(symbol, crypto_name, crypto_type)
             
         except Exception as e:
-            logger.error(f"❌ Error sending Twelve Data stock content: {e}")
+            logger.error("❌ Error sending Twelve Data stock content: %s", e)
 
     async def send_crypto_analysis(self, symbol, crypto_name, crypto_type):
         """שליחת ניתוח קריפטו"""
         try:
+            # טיק טרי מהזרם, ואם הזרם מנותק או ישן - קריאת REST
+            current_price = await asyncio.to_thread(self.twelve_api.get_price, symbol)
+            
+            if current_price is not None:
+                entry_price = current_price * CRYPTO_SIGNAL_RULE['entry']
+                stop_loss = current_price * CRYPTO_SIGNAL_RULE['stop']
+                profit_target_1 = current_price * CRYPTO_SIGNAL_RULE['target1']
+                profit_target_2 = current_price * CRYPTO_SIGNAL_RULE['target2']
+                price_line = f"${format_price(current_price)}"
+                strategy = f"""🟢 כניסה מומלצת: ${format_price(entry_price)} (+3%)
+🔴 סטופלוס חכם: ${format_price(stop_loss)} (-8%)
+🎯 יעד ראשון: ${format_price(profit_target_1)} (+12%)
+🚀 יעד שני: ${format_price(profit_target_2)} (+25%)"""
+            else:
+                price_line = "מעודכן בזמן אמת"
+                strategy = """🟢 כניסה מומלצת: +3% מהמחיר הנוכחי
+🔴 סטופלוס חכם: -8% מהמחיר הנוכחי
+🎯 יעד ראשון: +12% רווח
+🚀 יעד שני: +25% רווח מקסימלי"""
+            
             message = f"""🪙 {crypto_type} - אות קנייה בלעדי!
 
-💎 מטבע: {symbol.replace('/USD', '')} | מחיר נוכחי: מעודכן בזמן אמת
+💎 מטבע: {symbol.replace('/USD', '')} | מחיר נוכחי: {price_line}
 
 📊 ניתוח קריפטו מקצועי:
 • מומנטום: מתחזק 🚀
@@ -802,10 +2650,7 @@ class PeakTradeBot:
 • טרנד: חיובי לטווח הקצר
 
 🎯 אסטרטגיית הקריפטו שלנו:
-🟢 כניסה מומלצת: +3% מהמחיר הנוכחי
-🔴 סטופלוס חכם: -8% מהמחיר הנוכחי
-🎯 יעד ראשון: +12% רווח
-🚀 יעד שני: +25% רווח מקסימלי
+{strategy}
 
 ⚠️ קריפטו - סיכון גבוה, פוטנציאל רווח גבוה
 🔥 זוהי המלצה בלעדית לחברי VIP!
@@ -817,10 +2662,13 @@ class PeakTradeBot:
                 text=message
             )
             
-            logger.info(f"✅ Crypto analysis sent for {symbol}")
+            logger.info("✅ Crypto analysis sent for %s", symbol)
+            
+            if current_price is not None:
+                self.record_published_signal(symbol, 'crypto', current_price, entry_price, stop_loss, profit_target_1, profit_target_2)
             
         except Exception as e:
-            logger.error(f"❌ Error sending crypto analysis: {e}")
+            logger.error("❌ Error sending crypto analysis: %s", e)
 
     async def send_text_analysis(self, symbol, asset_type):
         """שליחת ניתוח טקסט אם הגרף נכשל"""
@@ -845,10 +2693,190 @@ class PeakTradeBot:
                 text=message
             )
             
-            logger.info(f"✅ Text analysis sent for {symbol}")
+            logger.info("✅ Text analysis sent for %s", symbol)
             
         except Exception as e:
-            logger.error(f"❌ Error sending text analysis: {e}")
+            logger.error("❌ Error sending text analysis: %s", e)
+
+    def record_published_signal(self, symbol, asset_type, reference_price, entry_price, stop_loss, target1, target2):
+        """שמירת איתות שפורסם למעקב תוצאות"""
+        try:
+            signal_id = self.signal_store.record_signal(
+                symbol, asset_type, float(reference_price), float(entry_price),
+                float(stop_loss), float(target1), float(target2)
+            )
+            logger.info("📝 Signal #%s recorded for %s", signal_id, symbol)
+        except Exception as e:
+            logger.error("❌ Error recording signal for %s: %s", symbol, e)
+
+    async def update_signal_outcomes(self):
+        """עדכון האיתותים הפתוחים מברים חדשים - במנות שעומדות במכסת הקרדיטים לדקה.
+
+        מניות נבדקות רק כשנסגר בר בשעות המסחר, קריפטו כל CRYPTO_TRACKING_EVERY_HOURS שעות
+        (כל סימבול עולה קרדיט, והברים שהצטברו בינתיים נבדקים יחד).
+        """
+        try:
+            now = datetime.now(timezone.utc)
+            track_stocks = stock_bars_closing(now)
+            track_crypto = now.hour % CRYPTO_TRACKING_EVERY_HOURS == 0
+            signals = [
+                signal for signal in self.signal_store.open_signals()
+                if (track_crypto if signal['asset_type'] == 'crypto' else track_stocks)
+            ]
+            if not signals:
+                return
+            
+            symbols = sorted({signal['symbol'] for signal in signals})
+            bars = {}
+            for start in range(0, len(symbols), SIGNAL_TRACKING_BATCH):
+                if start:
+                    await asyncio.sleep(60)
+                chunk = symbols[start:start + SIGNAL_TRACKING_BATCH]
+                bars.update(await asyncio.to_thread(self.twelve_api.get_batch_bars, chunk))
+            
+            updated = [signal for signal in signals if apply_bars_to_signal(signal, bars.get(signal['symbol'], []))]
+            self.signal_store.save_updates(updated)
+            
+            closed = sum(1 for signal in updated if signal['status'] == 'closed')
+            logger.info("📊 Signal tracker: %s open, %s updated, %s closed", len(signals), len(updated), closed)
+            
+        except Exception as e:
+            logger.error("❌ Error updating signal outcomes: %s", e)
+
+    async def send_weekly_signal_summary(self):
+        """סיכום שבועי של תוצאות האיתותים שנסגרו"""
+        try:
+            end = datetime.now(timezone.utc)
+            start = end - timedelta(days=7)
+            closed = self.signal_store.closed_between(
+                start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+            )
+            traded = [signal for signal in closed if signal['outcome'] != 'no_entry']
+            
+            if not traded:
+                logger.info("📊 No closed signals this week - skipping summary")
+                return
+            
+            target1_hits = sum(1 for signal in traded if signal['target1_hit_at'])
+            target2_hits = sum(1 for signal in traded if signal['outcome'] == 'target2')
+            stops = sum(1 for signal in traded if signal['outcome'] == 'stop')
+            returns = [signal['return_pct'] for signal in traded]
+            best = max(traded, key=lambda signal: signal['return_pct'])
+            
+            summary = f"""📊 סיכום שבועי - PeakTrade VIP
+
+✅ עסקאות שנסגרו השבוע: {len(traded)}
+🎯 הגיעו ליעד ראשון: {target1_hits} ({target1_hits / len(traded) * 100:.0f}%)
+🚀 הגיעו ליעד שני: {target2_hits} ({target2_hits / len(traded) * 100:.0f}%)
+🔴 נסגרו בסטופלוס: {stops}
+
+💰 תשואה ממוצעת לעסקה: {sum(returns) / len(returns):+.2f}%
+🏆 העסקה הטובה של השבוע: {best['symbol']} ({best['return_pct']:+.2f}%)
+
+#PeakTradeVIP #WeeklySummary"""
+            
+            await self.application.bot.send_message(
+                chat_id=CHANNEL_ID,
+                text=summary
+            )
+            
+            logger.info("✅ Weekly signal summary sent (%s trades)", len(traded))
+            
+        except Exception as e:
+            logger.error("❌ Error sending weekly signal summary: %s", e)
+
+    def restore_state_snapshot(self):
+        """טעינת תמונת המצב מההפעלה הקודמת - מחזיר True אם נטענה"""
+        snapshot = self.state_snapshot.read(self.clock.now())
+        if snapshot is None:
+            return False
+        meta, bars = snapshot
+        
+        restored_bars = sum(self.twelve_api.restore_bars(*item) for item in bars)
+        
+        subscribers = meta.get('subscribers') or {}
+        if subscribers.get('rows') is not None:
+            self.subscribers.load_rows(subscribers['rows'], subscribers.get('row_count', 0))
+        
+        if meta.get('last_send_time'):
+            self.last_send_time = datetime.strptime(meta['last_send_time'], "%Y-%m-%d %H:%M:%S")
+        self.recent_symbols.extend(meta.get('recent_symbols', []))
+        # בדיקות לפי מזהה צילום - רשומות בפורמט הישן (לפי משתמש) מדולגות
+        self.pending_reviews.update(
+            (review_id, review) for review_id, review in meta.get('pending_reviews', {}).items()
+            if 'user_id' in review
+        )
+        
+        # עבודה שלא הסתיימה חוזרת לתור לפני שה-workers עולים
+        for job in meta.get('pending_screenshots', []):
+            self.pending_screenshots[job['file_id']] = job
+            self.screenshot_queue.put_nowait(job)
+        
+        logger.info(
+            "✅ State snapshot from %s restored: %s bar series, %s subscribers, %s pending screenshots",
+            meta['created_at'], restored_bars, len(self.subscribers), len(self.pending_screenshots)
+        )
+        return True
+
+    async def save_state_snapshot(self):
+        """שמירת תמונת מצב - האיסוף בלולאה, הדחיסה והכתיבה ב-thread"""
+        meta = {
+            'created_at': self.clock.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'last_send_time': self.last_send_time.strftime("%Y-%m-%d %H:%M:%S") if self.last_send_time else None,
+            'recent_symbols': list(self.recent_symbols),
+            'subscribers': {'row_count': self.subscribers.row_count, 'rows': self.subscribers.to_rows()},
+            'pending_screenshots': list(self.pending_screenshots.values()),
+            'pending_reviews': self.pending_reviews,
+        }
+        bars = self.twelve_api.export_bars()
+        try:
+            await asyncio.to_thread(self.state_snapshot.write, meta, bars)
+        except Exception as e:
+            logger.error("❌ Error saving state snapshot: %s", e)
+
+    def build_application(self, base_url=None, base_file_url=None):
+        """יצירת Application - base_url מאפשר הפניה לשרת Bot API אחר (למשל שרת מקומי לבדיקות עומס)"""
+        builder = Application.builder().token(BOT_TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+        if base_url:
+            builder = builder.base_url(base_url)
+        if base_file_url:
+            builder = builder.base_file_url(base_file_url)
+        self.application = builder.build()
+        self.setup_handlers()
+
+    async def start_services(self, stream_prices=True):
+        """הפעלת polling ומשימות הרקע"""
+        await self.application.initialize()
+        await self.application.start()
+        await self.application.updater.start_polling()
+        
+        if stream_prices:
+            self.price_stream_task = asyncio.create_task(self.price_stream.run())
+        self.screenshot_worker_tasks = [
+            asyncio.create_task(self.run_screenshot_worker()) for _ in range(SCREENSHOT_WORKERS)
+        ]
+        self.trial_dispatcher_task = asyncio.create_task(self.run_trial_dispatcher())
+        logger.info("✅ Trial lifecycle dispatcher started")
+        if self.trial_schedule.pending_registrations():
+            self.application.create_task(self.retry_pending_registrations())
+
+    async def stop_services(self):
+        """עצירת משימות הרקע וה-Application"""
+        if self.trial_dispatcher_task:
+            self.trial_dispatcher_task.cancel()
+        if self.price_stream_task:
+            self.price_stream_task.cancel()
+        for task in self.screenshot_worker_tasks:
+            task.cancel()
+        if self.application:
+            await self.application.updater.stop()
+            await self.application.stop()
+            await self.application.shutdown()
+            logger.info("🔄 Bot shutdown complete")
+        if self.sheets:
+            self.sheets.close()
+        self.signal_store.close()
+        self.trial_schedule.close()
 
     async def run(self):
         """הפעלת הבוט עם Twelve Data"""
@@ -859,78 +2887,113 @@ class PeakTradeBot:
         if not sheets_connected:
             logger.error("❌ Failed to connect to Google Sheets - continuing without it")
         
-        self.application = Application.builder().token(BOT_TOKEN).build()
-        self.setup_handlers()
+        self.build_application()
+        
+        # תמונת מצב מההפעלה הקודמת - מנויים, ברים, מיקום בלוח התוכן ועבודה ממתינה
+        state_restored = self.restore_state_snapshot()
+        records = await self.load_subscriber_index()
+        
+        # אינדקס אירועי תקופת ניסיון לפי זמן יעד, והרשמות שעוד לא נכתבו לגיליון
+        await self.load_trial_schedule(records)
+        self.restore_pending_registrations()
         
-        # הגדרת scheduler לבדיקת תפוגת ניסיונות
         self.scheduler = AsyncIOScheduler(timezone="Asia/Jerusalem")
         
+        # מעקב תוצאות איתותים - עדכון שעתי וסיכום שבועי
+        self.scheduler.add_job(
+            self.update_signal_outcomes,
+            CronTrigger(minute=5),
+            id='update_signal_outcomes'
+        )
         self.scheduler.add_job(
-            self.check_trial_expiry,
-            CronTrigger(hour=9, minute=0),
-            id='check_trial_expiry'
+            self.send_weekly_signal_summary,
+            CronTrigger(day_of_week='sun', hour=20, minute=0),
+            id='send_weekly_signal_summary'
+        )
+        self.scheduler.add_job(
+            self.reconcile_trial_schedule,
+            CronTrigger(hour=4, minute=30),
+            id='reconcile_trial_schedule'
+        )
+        self.scheduler.add_job(
+            self.load_subscriber_index,
+            CronTrigger(minute=f'*/{SUBSCRIBER_SYNC_MINUTES}'),
+            id='sync_subscriber_index'
+        )
+        self.scheduler.add_job(
+            self.retry_pending_registrations,
+            CronTrigger(minute=f'*/{REGISTRATION_RETRY_MINUTES}'),
+            id='retry_pending_registrations'
+        )
+        self.scheduler.add_job(
+            self.save_state_snapshot,
+            CronTrigger(minute='*/5'),
+            id='save_state_snapshot'
         )
         
         self.scheduler.start()
-        logger.info("✅ Trial expiry scheduler started - checking daily at 9:00 AM")
+        logger.info("✅ Signal tracker scheduled - hourly updates, weekly summary on Sunday 20:00")
         
         try:
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling()
+            await self.start_services()
             
             logger.info("✅ PeakTrade VIP Bot is running successfully!")
             logger.info("📊 Twelve Data API integrated - 800 calls/day")
             logger.info("📊 Content: Every 30 minutes between 10:00-22:00")
             logger.info("📊 Stock pool: 60+ stocks from all sectors")
             logger.info("📊 Crypto pool: 10+ major cryptocurrencies")
-            logger.info("⏰ Trial expiry check: Daily at 9:00 AM")
-            logger.info(f"💰 Monthly subscription: {MONTHLY_PRICE}₪")
-            logger.info(f"📋 Google Sheets: {'✅ Connected' if sheets_connected else '❌ Not connected'}")
-            
-            # שליחת הודעת בדיקה מיידית
-            await asyncio.sleep(10)
-            try:
-                await self.send_guaranteed_stock_content()
-                logger.info("✅ Immediate Twelve Data test sent")
-            except Exception as e:
-                logger.error(f"❌ Test error: {e}")
+            logger.info("⏰ Trial lifecycle: %s events scheduled at exact trial times", len(self.trial_schedule))
+            logger.info("💰 Monthly subscription: %s₪", MONTHLY_PRICE)
+            logger.info("📋 Google Sheets: %s", '✅ Connected' if sheets_connected else '❌ Not connected')
+            logger.info("♻️ Warm start: %s", '✅ State snapshot restored' if state_restored else '❌ No snapshot - cold start')
+            
+            if self.last_send_time is None:
+                # שליחת הודעת בדיקה מיידית
+                await self.clock.sleep(10)
+                try:
+                    await self.send_guaranteed_stock_content()
+                    logger.info("✅ Immediate Twelve Data test sent")
+                except Exception as e:
+                    logger.error("❌ Test error: %s", e)
+                self.last_send_time = self.clock.now()
+            else:
+                # המשך הקצב מההפעלה הקודמת - בלי פרסום כפול אחרי redeploy
+                logger.info("⏩ Content cadence resumed - last post at %s", self.last_send_time.strftime('%H:%M'))
             
             # לולאה עם שליחה מאולצת כל 30 דקות
-            last_send_time = datetime.now()
-            
             while True:
-                current_time = datetime.now()
+                current_time = self.clock.now()
                 
-                if (current_time - last_send_time).total_seconds() >= 1800:  # 30 דקות
+                if current_time - self.last_send_time >= CONTENT_INTERVAL:
                     if 10 <= current_time.hour < 22:
                         try:
-                            logger.info(f"🕐 Forcing Twelve Data content at {current_time.strftime('%H:%M')}")
+                            logger.info("🕐 Forcing Twelve Data content at %s", current_time.strftime('%H:%M'))
                             await self.send_guaranteed_stock_content()
-                            last_send_time = current_time
+                            self.last_send_time = current_time
                             logger.info("✅ Forced Twelve Data content sent successfully!")
                         except Exception as e:
-                            logger.error(f"❌ Error in forced Twelve Data send: {e}")
+                            logger.error("❌ Error in forced Twelve Data send: %s", e)
                 
-                await asyncio.sleep(60)
+                await self.clock.sleep(60)
                 
         except Exception as e:
-            logger.error(f"❌ Bot error: {e}")
+            logger.error("❌ Bot error: %s", e)
         finally:
             if self.scheduler and self.scheduler.running:
                 self.scheduler.shutdown()
                 logger.info("🔄 Scheduler shutdown")
-            if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
-                logger.info("🔄 Bot shutdown complete")
+            await self.stop_services()
+            await self.save_state_snapshot()
 
 if __name__ == "__main__":
-    bot = PeakTradeBot()
+    log_listener = setup_logging()
     try:
+        check_environment()
+        bot = PeakTradeBot()
         asyncio.run(bot.run())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
+    finally:
+        log_listener.stop()
@@ -0,0 +1,502 @@
+"""בדיקת עומס מקצה לקצה - שרת Bot API מזויף, גיליון מזויף ו-PeakTradeBot אמיתי.
+
+השרת המקומי מחקה את Bot API של טלגרם (getUpdates, sendMessage, createChatInviteLink...),
+מחזיק תור של עדכונים סינתטיים ומודד כמה זמן לוקח לבוט להגיב לכל אחד מהם.
+
+    python load_test.py --users 2000 --pattern spike --duration 60
+    python load_test.py --users 500 --pattern poisson --rate 20 --sheets-latency 0.2
+"""
+import argparse
+import asyncio
+import collections
+import email.parser
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from gspread.cell import Cell
+
+logger = logging.getLogger('load_test')
+
+LOAD_TEST_TOKEN = '123456:LOADTEST'
+LOAD_TEST_CHANNEL_ID = '-1001000000000'
+LOAD_TEST_ADMIN_CHAT_ID = '999'
+FIRST_USER_ID = 1_000_000
+
+SHEET_HEADERS = [
+    'telegram_user_id', 'username', 'email', 'registration_date', 'disclaimer_status',
+    'trial_start_date', 'trial_end_date', 'payment_status', 'payment_screenshot', 'notes', 'last_updated'
+]
+
+
+class FakeWorksheet:
+    """גיליון בזיכרון עם אותו ממשק gspread שהבוט משתמש בו, כולל השהיה מדומה"""
+
+    def __init__(self, latency=0.05, per_row_latency=0.0):
+        self.latency = latency
+        self.per_row_latency = per_row_latency
+        self.rows = [list(SHEET_HEADERS)]
+        self.rows_by_user = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+
+    def _wait(self, rows=0):
+        if self.latency or self.per_row_latency:
+            time.sleep(self.latency + self.per_row_latency * rows)
+
+    def get_all_records(self):
+        self.calls['get_all_records'] += 1
+        self._wait(len(self.rows))
+        with self.lock:
+            return [dict(zip(self.rows[0], row)) for row in self.rows[1:]]
+
+    def append_row(self, values):
+        self.calls['append_row'] += 1
+        self._wait()
+        with self.lock:
+            self.rows.append(list(values) + [''] * (len(SHEET_HEADERS) - len(values)))
+            self.rows_by_user[str(values[0])].append(len(self.rows))
+        return {'updates': {'updatedRange': f"Sheet1!A{len(self.rows)}:K{len(self.rows)}"}}
+
+    def update_cell(self, row, col, value):
+        self.calls['update_cell'] += 1
+        self._wait()
+        with self.lock:
+            self.rows[row - 1][col - 1] = value
+
+    def update_cells(self, cells):
+        self.calls['update_cells'] += 1
+        self._wait()
+        with self.lock:
+            for cell in cells:
+                self.rows[cell.row - 1][cell.col - 1] = cell.value
+
+    def findall(self, query, in_column=None):
+        self.calls['findall'] += 1
+        self._wait()
+        with self.lock:
+            return [Cell(row, 1, query) for row in self.rows_by_user.get(str(query), [])]
+
+    def row_values(self, row):
+        self.calls['row_values'] += 1
+        self._wait()
+        with self.lock:
+            return [str(value) for value in self.rows[row - 1]]
+
+    def col_values(self, col):
+        self.calls['col_values'] += 1
+        self._wait(len(self.rows))
+        with self.lock:
+            return [row[col - 1] for row in self.rows]
+
+    def duplicate_users(self):
+        return {user_id: len(rows) for user_id, rows in self.rows_by_user.items() if len(rows) > 1}
+
+
+class FakeBotAPI:
+    """מצב השרת המזויף - תור עדכונים, תשובות הבוט ומדידות"""
+
+    BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'PeakTrade', 'username': 'peaktrade_load_bot'}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates_ready = threading.Condition(self.lock)
+        self.pending = collections.deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.loop = None
+        # הודעות שעוד לא קיבלו תשובה - לפי צ'אט, לפי סדר; לחיצות כפתור - לפי id
+        self.outstanding = collections.defaultdict(collections.deque)
+        self.outstanding_callbacks = {}
+        self.latencies = collections.defaultdict(list)
+        self.invite_latencies = []
+        self.started_at = {}
+        self.invites_by_user = collections.Counter()
+        self.method_calls = collections.Counter()
+        self.http_errors = 0
+
+    # --- צד הלקוח (מחולל העומס) ---
+
+    def enqueue(self, kind, user_id, payload, track=True):
+        """הוספת עדכון לתור - מחזיר asyncio.Event שמסומן כשהבוט מגיב לראשונה"""
+        done = asyncio.Event()
+        with self.lock:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            now = time.perf_counter()
+            self.pending.append({'update_id': update_id, **payload})
+            if track and kind == 'callback':
+                self.outstanding_callbacks[payload['callback_query']['id']] = (kind, now, done)
+            elif track:
+                self.outstanding[user_id].append((kind, now, done))
+            if kind == 'start':
+                self.started_at.setdefault(user_id, now)
+            self.updates_ready.notify_all()
+        return done
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    # --- צד השרת (קריאות הבוט) ---
+
+    def _message(self, chat_id, text=None, **extra):
+        with self.lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': {'id': int(chat_id), 'type': 'private'}, 'from': self.BOT_USER, **extra}
+        if text is not None:
+            message['text'] = text
+        return message
+
+    def _responded(self, chat_id=None, callback_query_id=None):
+        """רישום תשובה ראשונה - ללחיצת כפתור לפי id, להודעה לפי הוותיקה ביותר בצ'אט"""
+        now = time.perf_counter()
+        with self.lock:
+            if callback_query_id is not None:
+                entry = self.outstanding_callbacks.pop(callback_query_id, None)
+            else:
+                queue = self.outstanding.get(int(chat_id))
+                entry = queue.popleft() if queue else None
+            if entry is None:
+                return
+            kind, enqueued_at, done = entry
+            self.latencies[kind].append(now - enqueued_at)
+        self.loop.call_soon_threadsafe(done.set)
+
+    def get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = float(params.get('timeout', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                # עדכונים עם id קטן מ-offset אושרו על ידי הבוט
+                while self.pending and self.pending[0]['update_id'] < offset:
+                    self.pending.popleft()
+                if self.pending:
+                    return list(itertools.islice(self.pending, limit))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.updates_ready.wait(remaining)
+
+    def handle(self, method, params):
+        self.method_calls[method] += 1
+        if method == 'getMe':
+            return {**self.BOT_USER, 'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method in ('deleteWebhook', 'setWebhook', 'close', 'logOut', 'banChatMember'):
+            return True
+        if method == 'answerCallbackQuery':
+            self._responded(callback_query_id=params['callback_query_id'])
+            return True
+        if method == 'sendMessage':
+            self._responded(chat_id=params['chat_id'])
+            return self._message(params['chat_id'], params.get('text'))
+        if method == 'editMessageText':
+            # עריכה היא המשך לתשובה קודמת - לא נספרת כתשובה ראשונה
+            return self._message(params['chat_id'], params.get('text'))
+        if method == 'editMessageCaption':
+            return self._message(params['chat_id'], caption=params.get('caption'))
+        if method == 'sendPhoto':
+            return self._message(params['chat_id'], photo=[{'file_id': 'sent', 'file_unique_id': 'sent',
+                                                            'width': 1, 'height': 1}])
+        if method == 'createChatInviteLink':
+            user_id = int(params.get('name', 'Trial_0').split('_')[1])
+            now = time.perf_counter()
+            with self.lock:
+                self.invites_by_user[user_id] += 1
+                if user_id in self.started_at and self.invites_by_user[user_id] == 1:
+                    self.invite_latencies.append(now - self.started_at[user_id])
+            return {'invite_link': f"https://t.me/+loadtest{user_id}", 'creator': self.BOT_USER,
+                    'creates_join_request': False, 'is_primary': False, 'is_revoked': False,
+                    'name': params.get('name'), 'member_limit': int(params.get('member_limit', 1))}
+        if method == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': params['file_id'],
+                    'file_size': 200_000, 'file_path': f"photos/{params['file_id']}.jpg"}
+        raise KeyError(method)
+
+
+def _parse_body(headers, body):
+    """פענוח פרמטרים - JSON, טופס urlencoded או multipart"""
+    content_type = headers.get('Content-Type', '')
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is None:
+                params[name] = part.get_payload(decode=True).decode()
+        return params
+    params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+    return params
+
+
+def make_handler(api):
+    class FakeBotAPIHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload, content_type='application/json'):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # הורדת קבצים: /file/bot<token>/<path> - תוכן אקראי לכל קובץ
+            if self.path.startswith('/file/'):
+                self._reply(200, os.urandom(200_000), 'image/jpeg')
+            else:
+                self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            body = self.rfile.read(length)
+            method = self.path.rsplit('/', 1)[-1]
+            try:
+                params = _parse_body(self.headers, body)
+                result = api.handle(method, params)
+                self._reply(200, {'ok': True, 'result': result})
+            except Exception as e:
+                with api.lock:
+                    api.http_errors += 1
+                self._reply(400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"})
+
+    return FakeBotAPIHandler
+
+
+def start_fake_server(api, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, 0), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- מחולל העומס ---
+
+def arrival_times(pattern, users, duration, rate):
+    """זמני הגעה (שניות מתחילת הריצה) לפי דפוס"""
+    if pattern == 'constant':
+        return [i / rate for i in range(users)]
+    if pattern == 'poisson':
+        times, t = [], 0.0
+        for _ in range(users):
+            t += random.expovariate(rate)
+            times.append(t)
+        return times
+    if pattern == 'spike':
+        # 80% מהמשתמשים מגיעים בעשירית הראשונה של הריצה
+        spike_users = int(users * 0.8)
+        spike = sorted(random.uniform(0, duration * 0.1) for _ in range(spike_users))
+        rest = sorted(random.uniform(0, duration) for _ in range(users - spike_users))
+        return sorted(spike + rest)
+    if pattern == 'ramp':
+        # קצב עולה לינארית מאפס - זמן ההגעה ה-i הוא duration * sqrt(i / users)
+        return [duration * (i / users) ** 0.5 for i in range(users)]
+    raise ValueError(f"unknown pattern {pattern}")
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"load{user_id}"}
+
+
+def _chat(user_id):
+    return {'id': user_id, 'type': 'private'}
+
+
+async def _wait_for(done, timeout):
+    try:
+        await asyncio.wait_for(done.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def user_session(api, user_id, args, results):
+    """סשן משתמש: /start, ואז לחיצות על כפתורי התשלום ושליחת צילום מסך"""
+    user = _user(user_id)
+    start = {'message': {'message_id': 1, 'date': int(time.time()), 'chat': _chat(user_id), 'from': user,
+                         'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+    done = api.enqueue('start', user_id, start)
+    if random.random() < args.double_tap:
+        # לחיצה כפולה - לא נמדדת, רק נבדק שלא נוצר רישום כפול
+        api.enqueue('start', user_id, start, track=False)
+    if not await _wait_for(done, args.timeout):
+        results['timeouts'] += 1
+        return
+
+    if random.random() < args.callback_ratio:
+        for data in ('pay_yes', 'gpay_payment'):
+            callback = {'callback_query': {
+                'id': f"{user_id}-{data}", 'from': user, 'chat_instance': str(user_id), 'data': data,
+                'message': {'message_id': 2, 'date': int(time.time()), 'chat': _chat(user_id),
+                            'from': FakeBotAPI.BOT_USER, 'text': 'reminder'}
+            }}
+            if not await _wait_for(api.enqueue('callback', user_id, callback), args.timeout):
+                results['timeouts'] += 1
+                return
+
+    if random.random() < args.photo_ratio:
+        photo = {'message': {'message_id': 3, 'date': int(time.time()), 'chat': _chat(user_id), 'from': user,
+                             'photo': [{'file_id': f"shot{user_id}", 'file_unique_id': f"shot{user_id}",
+                                        'width': 800, 'height': 600, 'file_size': 200_000}]}}
+        if not await _wait_for(api.enqueue('photo', user_id, photo), args.timeout):
+            results['timeouts'] += 1
+
+
+async def sample_queues(api, bot, samples, interval=0.25):
+    while True:
+        samples['api_pending'].append(api.queue_depth())
+        samples['bot_update_queue'].append(bot.application.update_queue.qsize())
+        samples['screenshot_queue'].append(bot.screenshot_queue.qsize())
+        await asyncio.sleep(interval)
+
+
+def percentiles(values):
+    if not values:
+        return 'n/a'
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return (f"n={len(ordered)} p50={pick(0.5):.0f}ms p90={pick(0.9):.0f}ms "
+            f"p99={pick(0.99):.0f}ms max={ordered[-1] * 1000:.0f}ms")
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+async def run_load_test(args):
+    api = FakeBotAPI()
+    api.loop = asyncio.get_running_loop()
+    server = start_fake_server(api)
+    host, port = server.server_address
+
+    import bot_only
+    error_counter = ErrorCounter()
+    logging.getLogger('bot_only').addHandler(error_counter)
+    if not args.verbose:
+        logging.getLogger('bot_only').setLevel(logging.WARNING)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    bot = bot_only.PeakTradeBot()
+    sheet = FakeWorksheet(args.sheets_latency, args.sheets_row_latency)
+    # ברירת המחדל בלי מכסה - מודדים את הבוט, לא את קצב Google
+    bot.attach_sheet(sheet, requests_per_minute=args.sheets_quota)
+    bot.build_application(
+        base_url=f"http://{host}:{port}/bot",
+        base_file_url=f"http://{host}:{port}/file/bot"
+    )
+    await bot.start_services(stream_prices=False)
+
+    results = collections.Counter()
+    samples = collections.defaultdict(list)
+    sampler = asyncio.create_task(sample_queues(api, bot, samples))
+
+    logger.info(f"🚀 Load test: {args.users} users, pattern={args.pattern}, server=http://{host}:{port}")
+    started = time.perf_counter()
+    sessions = []
+    for i, at in enumerate(arrival_times(args.pattern, args.users, args.duration, args.rate)):
+        delay = at - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sessions.append(asyncio.create_task(user_session(api, FIRST_USER_ID + i, args, results)))
+    await asyncio.gather(*sessions)
+    # המתנה לסיום עיבוד צילומי המסך ברקע
+    await asyncio.wait_for(bot.screenshot_queue.join(), timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+
+    sampler.cancel()
+    await bot.stop_services()
+    server.shutdown()
+
+    responded = sum(len(values) for values in api.latencies.values())
+    duplicate_invites = {user_id: n for user_id, n in api.invites_by_user.items() if n > 1}
+    duplicate_rows = sheet.duplicate_users()
+
+    print()
+    print(f"⏱  Elapsed: {elapsed:.1f}s for {args.users} users ({args.pattern})")
+    print(f"📈 Throughput: {responded / elapsed:.1f} responded updates/s")
+    for kind in ('start', 'callback', 'photo'):
+        print(f"   {kind:<9} first response: {percentiles(api.latencies.get(kind, []))}")
+    print(f"   invite link after /start: {percentiles(api.invite_latencies)}")
+    print(f"❌ Errors: {results['timeouts']} timed-out updates, {api.http_errors} rejected API calls, "
+          f"{error_counter.count} bot error logs")
+    for name, values in samples.items():
+        if values:
+            print(f"📥 Queue {name}: max={max(values)} mean={statistics.mean(values):.1f}")
+    print(f"📋 Sheets calls: {dict(sheet.calls)}")
+    print(f"🔗 Invite links: {sum(api.invites_by_user.values())} for {len(api.invites_by_user)} users")
+    print(f"{'✅' if not duplicate_invites else '❌'} Users with >1 invite link: {len(duplicate_invites)}")
+    print(f"{'✅' if not duplicate_rows else '❌'} Users with >1 sheet row: {len(duplicate_rows)}")
+    return not duplicate_invites and not duplicate_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a local fake Bot API")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--pattern', choices=['constant', 'poisson', 'spike', 'ramp'], default='spike')
+    parser.add_argument('--duration', type=float, default=30.0, help="arrival window in seconds")
+    parser.add_argument('--rate', type=float, default=50.0, help="arrivals/s for constant and poisson")
+    parser.add_argument('--callback-ratio', type=float, default=0.5, help="share of users tapping payment buttons")
+    parser.add_argument('--photo-ratio', type=float, default=0.1, help="share of users sending a screenshot")
+    parser.add_argument('--double-tap', type=float, default=0.2, help="share of users sending /start twice at once")
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help="seconds per fake Sheets call")
+    parser.add_argument('--sheets-row-latency', type=float, default=0.00001, help="extra seconds per row read")
+    parser.add_argument('--sheets-quota', type=int, default=None, help="Sheets requests per minute (default: unlimited)")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # הבוט קורא את ההגדרות בזמן import - מפנים את כל הקבצים לתיקייה זמנית
+    workdir = tempfile.mkdtemp(prefix='peaktrade_load_')
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': LOAD_TEST_TOKEN,
+        'CHANNEL_ID': LOAD_TEST_CHANNEL_ID,
+        'ADMIN_CHAT_ID': LOAD_TEST_ADMIN_CHAT_ID,
+        'GOOGLE_CREDENTIALS': '{}',
+        'SPREADSHEET_ID': 'load-test',
+        'TWELVE_DATA_API_KEY': 'load-test',
+        'TRIAL_SCHEDULE_FILE': os.path.join(workdir, 'trial_schedule.db'),
+        'SIGNALS_DB_FILE': os.path.join(workdir, 'signals.db'),
+        'PAYMENT_SCREENSHOTS_DIR': os.path.join(workdir, 'payment_screenshots'),
+    })
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    ok = asyncio.run(run_load_test(args))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
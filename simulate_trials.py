@@ -0,0 +1,285 @@
+"""סימולציה מואצת של מחזור חיי תקופת הניסיון - שעון מדומה, גיליון וטלגרם בזיכרון.
+
+השעון קופץ מאירוע לאירוע (הרשמה, תשלום, תזכורת, הודעה סופית, הסרה) דרך אותו קוד
+של PeakTradeBot, כך ששבועות של עבודה עוברים בשניות:
+
+    python simulate_trials.py --users 100000 --days 14
+    python simulate_trials.py --users 20000 --pay-ratio 0.3 --sheets-latency 0.0002
+"""
+import argparse
+import asyncio
+import collections
+import heapq
+import logging
+import os
+import random
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+from telegram.error import NetworkError
+
+logger = logging.getLogger('simulate_trials')
+
+SIMULATION_START = datetime(2025, 1, 5)
+SIMULATION_CHANNEL_ID = '-1001000000000'
+FIRST_USER_ID = 1_000_000
+LIFECYCLE_TAIL = timedelta(days=10)  # זמן אחרי ההרשמה האחרונה עד שכל האירועים שלה הסתיימו
+
+
+class FakeTelegramBot:
+    """הבוט המזויף - סופר את ההודעות שנשלחו לפי סוג ולפי יום.
+
+    למשתמשים ב-flaky_users הניסיון הראשון של כל סוג הודעה (והסרה) נכשל - בודק שהאירוע חוזר לתור.
+    """
+
+    def __init__(self, clock, payment_link, flaky_users=()):
+        self.clock = clock
+        self.payment_link = payment_link
+        self.flaky_users = set(flaky_users)
+        self.failed = collections.Counter()
+        self.per_day = collections.defaultdict(collections.Counter)
+        self.per_user = collections.defaultdict(collections.Counter)
+
+    def _count(self, kind, user_id):
+        if user_id in self.flaky_users and (kind, user_id) not in self.failed:
+            self.failed[(kind, user_id)] += 1
+            raise NetworkError(f"simulated {kind} failure")
+        self.per_day[(self.clock.now() - SIMULATION_START).days][kind] += 1
+        self.per_user[kind][user_id] += 1
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        if reply_markup is not None:
+            kind = 'reminders'
+        elif self.payment_link in text:
+            kind = 'finals'
+        else:
+            kind = 'goodbyes'
+        self._count(kind, chat_id)
+
+    async def ban_chat_member(self, chat_id, user_id, **kwargs):
+        self._count('removals', user_id)
+
+
+class FlakyWorksheet:
+    """עטיפה לגיליון בזיכרון שמכשילה את כתיבת ההרשמה של חלק מהמשתמשים.
+
+    לפי user_id % 3: כישלון אחד לפני הכתיבה, כישלון אחד אחרי שהשורה כבר נכתבה (timeout),
+    או כישלון בכל הניסיונות המיידיים - ההרשמה עוברת לניסיון החוזר ברקע.
+    """
+
+    def __init__(self, worksheet, flaky_users, immediate_attempts):
+        self.worksheet = worksheet
+        self.failures_left = {
+            user_id: immediate_attempts if user_id % 3 == 2 else 1 for user_id in flaky_users
+        }
+        self.failed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.worksheet, name)
+
+    def append_row(self, values):
+        user_id = values[0]
+        if self.failures_left.get(user_id):
+            self.failures_left[user_id] -= 1
+            self.failed += 1
+            if user_id % 3 == 1:
+                self.worksheet.append_row(values)
+            raise ConnectionError("simulated Sheets append failure")
+        return self.worksheet.append_row(values)
+
+
+def build_timeline(users, days, pay_ratio, seed):
+    """זמני הרשמה אקראיים לאורך החלון, ותשלום לחלק מהמשתמשים לפני מועד ההסרה"""
+    rng = random.Random(seed)
+    window = days * 86400
+    arrivals = sorted(
+        (SIMULATION_START + timedelta(seconds=rng.uniform(0, window)), FIRST_USER_ID + i)
+        for i in range(users)
+    )
+    payments = []
+    for registered_at, user_id in arrivals:
+        if rng.random() < pay_ratio:
+            # תשלום במהלך הניסיון או אחרי ההודעה הסופית - לפני ההסרה
+            payments.append((registered_at + timedelta(seconds=rng.uniform(60, 9 * 86400 - 60)), user_id))
+    heapq.heapify(payments)
+    return arrivals, payments
+
+
+async def mark_paid(bot, user_id):
+    """אותה כתיבה שהמנהל מבצע באישור תשלום"""
+    entry = bot.subscribers.get(user_id)
+    if entry is None or not entry[0]:
+        return False
+    current_time = bot.clock.now().strftime("%Y-%m-%d %H:%M:%S")
+    await bot.sheets.update_row(entry[0], {8: "paid_subscriber", 11: current_time})
+    bot.subscribers.set_status(user_id, "paid_subscriber")
+    return True
+
+
+async def run_simulation(args):
+    import bot_only
+    from load_test import FakeWorksheet
+
+    clock = bot_only.VirtualClock(SIMULATION_START)
+    bot = bot_only.PeakTradeBot(clock=clock)
+    arrivals, payments = build_timeline(args.users, args.days, args.pay_ratio, args.seed)
+    flaky_users = random.Random(args.seed + 1).sample(
+        [user_id for _, user_id in arrivals], int(len(arrivals) * args.fail_ratio)
+    )
+    telegram = FakeTelegramBot(clock, bot_only.PAYPAL_PAYMENT_LINK, flaky_users)
+    bot.application = types.SimpleNamespace(bot=telegram)
+    sheet = FakeWorksheet(latency=args.sheets_latency)
+    flaky_sheet = FlakyWorksheet(sheet, flaky_users, bot_only.REGISTRATION_APPEND_ATTEMPTS)
+    # הגיליון בזיכרון - הקריאות רצות ישירות, בלי thread pool ובלי מכסה
+    bot.attach_sheet(flaky_sheet, requests_per_minute=None, inline=True)
+
+    end = arrivals[-1][0] + LIFECYCLE_TAIL if arrivals else SIMULATION_START
+    paid_at = {}
+
+    per_day = collections.defaultdict(collections.Counter)
+    timings = collections.defaultdict(collections.Counter)
+    max_batch = collections.Counter()
+    steps = 0
+    next_arrival = 0
+
+    logger.info(f"🚀 Simulating {args.users} users over {args.days} days (+{LIFECYCLE_TAIL.days} days tail)")
+    started = time.perf_counter()
+
+    while True:
+        candidates = []
+        if next_arrival < len(arrivals):
+            candidates.append(arrivals[next_arrival][0])
+        if payments:
+            candidates.append(payments[0][0])
+        next_due = bot.trial_schedule.next_due()
+        if next_due is not None:
+            candidates.append(next_due)
+        if not candidates or min(candidates) > end:
+            break
+
+        clock.advance_to(min(candidates))
+        now = clock.now()
+        day = (now - SIMULATION_START).days
+        steps += 1
+
+        sheet_calls_before = sum(bot.sheets.calls.values())
+        step_started = time.perf_counter()
+        while next_arrival < len(arrivals) and arrivals[next_arrival][0] <= now:
+            user_id = arrivals[next_arrival][1]
+            await bot.log_user_registration(types.SimpleNamespace(id=user_id, username=f"sim{user_id}"))
+            per_day[day]['registrations'] += 1
+            next_arrival += 1
+        # הרשמות שכל הניסיונות המיידיים שלהן נכשלו - כמו המשימה המתוזמנת בבוט
+        await bot.retry_pending_registrations()
+        registered = time.perf_counter()
+
+        while payments and payments[0][0] <= now:
+            _, user_id = heapq.heappop(payments)
+            if await mark_paid(bot, user_id):
+                paid_at[user_id] = now
+                per_day[day]['payments'] += 1
+        paid = time.perf_counter()
+
+        due_count = len(bot.trial_schedule)
+        await bot.check_trial_expiry()
+        due_count -= len(bot.trial_schedule)
+        finished = time.perf_counter()
+
+        timings[day]['registration'] += registered - step_started
+        timings[day]['payment'] += paid - registered
+        timings[day]['lifecycle'] += finished - paid
+        per_day[day]['due_events'] += due_count
+        per_day[day]['sheet_calls'] += sum(bot.sheets.calls.values()) - sheet_calls_before
+        max_batch[day] = max(max_batch[day], due_count)
+
+    elapsed = time.perf_counter() - started
+    total_days = (end - SIMULATION_START).days + 1
+
+    print()
+    print(f"{'day':>4} {'regs':>7} {'paid':>6} {'due':>7} {'remind':>7} {'final':>7} {'remove':>7} "
+          f"{'sheets':>8} {'reg ms':>8} {'life ms':>8} {'batch':>6}")
+    for day in range(total_days):
+        counts = per_day[day]
+        sent = telegram.per_day[day]
+        print(f"{day:>4} {counts['registrations']:>7} {counts['payments']:>6} {counts['due_events']:>7} "
+              f"{sent['reminders']:>7} {sent['finals']:>7} {sent['removals']:>7} "
+              f"{counts['sheet_calls']:>8} "
+              f"{timings[day]['registration'] * 1000:>8.0f} {timings[day]['lifecycle'] * 1000:>8.0f} "
+              f"{max_batch[day]:>6}")
+
+    # בדיקות נכונות - כל מי שלא שילם הוסר פעם אחת, מי ששילם לא הוסר, ואף הודעה לא נשלחה פעמיים
+    removed = telegram.per_user['removals']
+    non_payers = {user_id for _, user_id in arrivals} - set(paid_at)
+    wrongly_removed = [user_id for user_id in removed if user_id in paid_at]
+    missed = [user_id for user_id in non_payers if removed[user_id] != 1]
+    # גם תזכורת והודעה סופית שנכשלו בפעם הראשונה הגיעו בסוף
+    unreminded = [
+        user_id for user_id in non_payers
+        if telegram.per_user['reminders'][user_id] != 1 or telegram.per_user['finals'][user_id] != 1
+    ]
+    duplicate_rows = sheet.duplicate_users()
+    pending = bot.trial_schedule.pending_registrations()
+    repeated = {
+        kind: sum(1 for n in counter.values() if n > 1)
+        for kind, counter in telegram.per_user.items()
+    }
+
+    print()
+    print(f"⏱  Simulated {total_days} days in {elapsed:.1f}s ({steps} clock steps, "
+          f"{steps / elapsed:,.0f} steps/s)")
+    print(f"📋 Sheets calls: {dict(bot.sheets.calls)}")
+    print(f"⏰ Events left in schedule: {len(bot.trial_schedule)}")
+    print(f"💥 Injected Telegram failures: {sum(telegram.failed.values())} "
+          f"({len(telegram.flaky_users)} flaky users, retried by the schedule)")
+    print(f"💥 Injected Sheets append failures: {flaky_sheet.failed} "
+          f"(counted by the bot: {bot.registration_append_failures})")
+    print(f"{'✅' if not pending else '❌'} Registrations never written to the sheet: {len(pending)}")
+    print(f"{'✅' if not duplicate_rows else '❌'} Users with duplicate sheet rows: {len(duplicate_rows)}")
+    print(f"{'✅' if not missed else '❌'} Non-paying users not removed exactly once: {len(missed)}")
+    print(f"{'✅' if not wrongly_removed else '❌'} Paying users removed: {len(wrongly_removed)}")
+    print(f"{'✅' if not unreminded else '❌'} Non-paying users without exactly one reminder and final: {len(unreminded)}")
+    print(f"{'✅' if not any(repeated.values()) else '❌'} Users with a repeated message: {repeated}")
+    return (not missed and not wrongly_removed and not unreminded and not any(repeated.values())
+            and not pending and not duplicate_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast-forward simulation of the trial lifecycle on a virtual clock")
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=14, help="registration window in days")
+    parser.add_argument('--pay-ratio', type=float, default=0.1, help="share of users who pay before removal")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="real seconds per fake Sheets call")
+    parser.add_argument('--fail-ratio', type=float, default=0.05,
+                        help="share of users whose first send/ban of each kind and sheet append fail")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    # הבוט קורא את ההגדרות בזמן import - בלי קבצים אמיתיים
+    workdir = tempfile.mkdtemp(prefix='peaktrade_sim_')
+    os.environ.update({
+        'CHANNEL_ID': SIMULATION_CHANNEL_ID,
+        'TRIAL_SCHEDULE_FILE': os.path.join(workdir, 'trial_schedule.db'),
+        'STATE_SNAPSHOT_FILE': '',
+        'SIGNALS_DB_FILE': ':memory:',
+        'PAYMENT_SCREENSHOTS_DIR': os.path.join(workdir, 'payment_screenshots'),
+    })
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    if not args.verbose:
+        logging.getLogger('bot_only').setLevel(logging.WARNING)
+        # כשלי הכתיבה המוזרקים נספרים בסיכום - בלי שורת לוג לכל אחד
+        logging.getLogger('bot_only').addFilter(
+            lambda record: getattr(record, 'event', None) not in ('registration_append_failed', 'registration_pending')
+        )
+
+    ok = asyncio.run(run_simulation(args))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""שרת WebSocket מקומי שמחקה את זרם המחירים של Twelve Data ומשמיע טיקים מוקלטים.
+
+הקלטה: הרצת הבוט עם TWELVE_DATA_WS_RECORD_FILE=ticks.jsonl
+השמעה:  python tick_replay_server.py ticks.jsonl --port 8765
+חיבור הבוט: TWELVE_DATA_WS_URL=ws://127.0.0.1:8765
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+import websockets
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def load_ticks(path):
+    """טעינת טיקים מוקלטים (שורת JSON לכל טיק)"""
+    ticks = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                ticks.append(json.loads(line))
+    ticks.sort(key=lambda tick: tick.get('timestamp') or 0)
+    return ticks
+
+
+class TickReplayServer:
+    """משמיע טיקים לפי סדר ה-timestamp שלהם, מואץ פי speed"""
+
+    def __init__(self, ticks, speed=60.0, loop_ticks=False, drop_after=None):
+        self.ticks = ticks
+        self.speed = speed
+        self.loop_ticks = loop_ticks
+        self.drop_after = drop_after
+        self.connections = 0
+
+    async def _replay(self, websocket, symbols):
+        sent = 0
+        while True:
+            previous_ts = None
+            for tick in self.ticks:
+                if tick.get('symbol') not in symbols:
+                    continue
+                ts = tick.get('timestamp')
+                if previous_ts is not None and ts is not None and self.speed > 0:
+                    await asyncio.sleep(max(0, ts - previous_ts) / self.speed)
+                previous_ts = ts
+                await websocket.send(json.dumps(tick))
+                sent += 1
+                # ניתוק יזום לבדיקת התחברות מחדש
+                if self.drop_after and sent >= self.drop_after:
+                    logger.info(f"✂️ Dropping connection after {sent} ticks")
+                    await websocket.close()
+                    return
+            if not self.loop_ticks:
+                return
+
+    async def handler(self, websocket, path=None):
+        self.connections += 1
+        logger.info(f"🔌 Client connected (connection #{self.connections})")
+        replay_task = None
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                action = message.get('action')
+                if action == 'subscribe':
+                    symbols = [s for s in message['params']['symbols'].split(',') if s]
+                    known = {tick.get('symbol') for tick in self.ticks}
+                    await websocket.send(json.dumps({
+                        'event': 'subscribe-status',
+                        'status': 'ok',
+                        'success': [{'symbol': s} for s in symbols if s in known],
+                        'fails': [{'symbol': s} for s in symbols if s not in known],
+                    }))
+                    if replay_task:
+                        replay_task.cancel()
+                    replay_task = asyncio.create_task(self._replay(websocket, set(symbols)))
+                elif action == 'heartbeat':
+                    await websocket.send(json.dumps({'event': 'heartbeat', 'status': 'ok'}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if replay_task:
+                replay_task.cancel()
+            logger.info("🔌 Client disconnected")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Twelve Data ticks over a local WebSocket")
+    parser.add_argument('ticks_file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=60.0, help="replay speed multiplier (0 = no delay)")
+    parser.add_argument('--loop', action='store_true', help="replay the recording forever")
+    parser.add_argument('--drop-after', type=int, default=None, help="close the connection after N ticks")
+    args = parser.parse_args()
+
+    server = TickReplayServer(load_ticks(args.ticks_file), args.speed, args.loop, args.drop_after)
+    async with websockets.serve(server.handler, args.host, args.port):
+        logger.info(f"✅ Tick replay server on ws://{args.host}:{args.port} ({len(server.ticks)} ticks)")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Replay server stopped")